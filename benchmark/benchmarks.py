@@ -0,0 +1,215 @@
+# tightb generate tight-binding hamiltoniann crystalline structures
+# Copyright (C) 2021  Matheus S. M. Sousa
+#
+# This file is part of tightb.
+#
+# tightb is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# tightb is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with tightb.  If not, see <https://www.gnu.org/licenses/>.
+
+# Scaling benchmarks of the generator and of the symmetry detection.
+#
+#     python -m benchmark.benchmarks --output results.json
+#     python -m benchmark.benchmarks --compare old.json new.json
+#
+# Every benchmark is timed on increasing sizes until one measurement takes
+# longer than the time budget, and the exponent of t ~ size**p is fitted to
+# the measurements. Sizes are counted in orbitals for the generator, in
+# elements for the writer and in lattice points for the symmetry functions.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+import tightb.symmetry as symmetry
+from tightb.tightb import Graphene
+from tightb.writers import ExpressionTable, FortranWriter
+
+# Measurements shorter than this are too noisy to enter the fit
+min_fit_seconds = 1e-3
+
+term_combinations = [
+        dict(orbitals=1),
+        dict(orbitals=2),
+        dict(orbitals=2, rashba_soc=True),
+        dict(orbitals=2, external_mag=True),
+        dict(orbitals=2, rashba_soc=True, external_mag=True),
+]
+
+
+def best_time(fn, repeat: int) -> float:
+    # Best of `repeat` runs, a single one when it is slow anyway
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+        if times[-1] > 1.0:
+            break
+    return min(times)
+
+
+def fit_exponent(sizes: list, seconds: list) -> float:
+    sizes, seconds = np.asarray(sizes), np.asarray(seconds)
+    fit = seconds >= min_fit_seconds
+    if np.count_nonzero(fit) < 2:
+        return None
+    return float(np.polyfit(np.log(sizes[fit]), np.log(seconds[fit]), 1)[0])
+
+
+def lattice_case(dx: int, dy: int, options: dict):
+    def run():
+        with open(os.devnull, 'w') as stream:
+            lattice = Graphene(dx,
+                               dy,
+                               writer=FortranWriter(stream),
+                               **options)
+            lattice.lattice(*lattice.terms())
+            lattice.writer.flush()
+
+    return dx * dy * options['orbitals'], run
+
+
+def writer_case(elements: int):
+    expressions = ExpressionTable(["t"])
+    rows = elements // 3
+    index = np.arange(rows * 3).reshape(rows, 3)
+    result = np.zeros((rows, 3), dtype=int)
+
+    def run():
+        with open(os.devnull, 'w') as stream:
+            writer = FortranWriter(stream)
+            writer.matrix_elements("tij1",
+                                   np.ones_like(index),
+                                   index,
+                                   index,
+                                   result=result,
+                                   orbitals=np.arange(rows),
+                                   expressions=expressions)
+            writer.flush()
+
+    return rows * 3, run
+
+
+def coordinates_case(n: int):
+    def run():
+        symmetry.graphene_lattice_real_coordinates(n, n)
+
+    return len(symmetry.graphene_lattice_real_coordinates(n, n)), run
+
+
+def symmetry_case(fn, n: int):
+    lattice = symmetry.graphene_lattice_real_coordinates(n, n)
+    boundary = symmetry.boundary_from_lattice(lattice)
+    return len(lattice), lambda: fn(lattice, boundary)
+
+
+def benchmarks() -> list:
+    # (name, parameters, sizes, case), case(size) returning the measured size
+    # and the function to time
+    lattice_sizes = [10, 20, 50, 100, 200, 500, 1000, 2000]
+    suite = [("Graphene.lattice", options, lattice_sizes,
+              lambda n, options=options: lattice_case(n, n, options))
+             for options in term_combinations]
+    suite += [
+            ("FortranWriter.matrix_elements", {},
+             [10**3, 10**4, 10**5, 10**6, 10**7], writer_case),
+            ("graphene_lattice_real_coordinates", {},
+             [10, 20, 50, 100, 200, 500, 1000, 2000], coordinates_case),
+            ("vertical_reflection_axis", {}, [1, 2, 4, 8, 16, 32, 64],
+             lambda n: symmetry_case(symmetry.vertical_reflection_axis, n)),
+            ("vertical_glide_axis", {}, [1, 2, 4, 8, 16, 32, 64],
+             lambda n: symmetry_case(symmetry.vertical_glide_axis, n)),
+    ]
+    return suite
+
+
+def run_benchmarks(budget: float, repeat: int, only: str = None) -> dict:
+    results = []
+    for name, parameters, sizes, case in benchmarks():
+        if only is not None and only not in name:
+            continue
+
+        record = dict(name=name,
+                      parameters=parameters,
+                      sizes=[],
+                      arguments=[],
+                      seconds=[])
+        for argument in sizes:
+            size, run = case(argument)
+            seconds = best_time(run, repeat)
+            record['arguments'].append(argument)
+            record['sizes'].append(size)
+            record['seconds'].append(seconds)
+            print(f"{name} {parameters} {argument}: {seconds:.4f} s",
+                  file=sys.stderr)
+            if seconds > budget and len(record['seconds']) >= 2:
+                break
+
+        record['exponent'] = fit_exponent(record['sizes'], record['seconds'])
+        results.append(record)
+
+    return dict(python=platform.python_version(),
+                numpy=np.__version__,
+                machine=platform.machine(),
+                benchmarks=results)
+
+
+def compare(old: dict, new: dict) -> None:
+    # Time ratios new/old on the sizes measured by both, and the exponents
+    def key(record):
+        return record['name'], json.dumps(record['parameters'],
+                                          sort_keys=True)
+
+    previous = {key(record): record for record in old['benchmarks']}
+    for record in new['benchmarks']:
+        if key(record) not in previous:
+            continue
+        before = dict(zip(previous[key(record)]['sizes'],
+                          previous[key(record)]['seconds']))
+        ratios = [
+                f"{size}: {seconds / before[size]:.2f}"
+                for size, seconds in zip(record['sizes'], record['seconds'])
+                if size in before and before[size] > 0.0
+        ]
+        print(f"{record['name']} {record['parameters']}: exponent "
+              f"{previous[key(record)]['exponent']} -> {record['exponent']}; "
+              f"time ratios {', '.join(ratios)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark.benchmarks')
+    parser.add_argument('--output', default='-')
+    parser.add_argument('--budget', type=float, default=10.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', default=None, required=False)
+    parser.add_argument('--compare', nargs=2, default=None, required=False)
+    args = parser.parse_args()
+
+    if args.compare:
+        old, new = [json.load(open(path)) for path in args.compare]
+        compare(old, new)
+        return
+
+    results = run_benchmarks(args.budget, args.repeat, args.only)
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=2)
+    else:
+        with open(args.output, 'w') as stream:
+            json.dump(results, stream, indent=2)
+
+
+if __name__ == '__main__':
+    main()
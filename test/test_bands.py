@@ -0,0 +1,66 @@
+# tightb generate tight-binding hamiltoniann crystalline structures
+# Copyright (C) 2021  Matheus S. M. Sousa
+#
+# This file is part of tightb.
+#
+# tightb is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# tightb is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with tightb.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from unittest.mock import patch
+import numpy as np
+from numpy.testing import assert_allclose
+from tightb.tightb import Graphene
+import tightb.bands
+
+
+class test_bands(unittest.TestCase):
+    def test_k_grid(self):
+        k = tightb.bands.k_grid(2, 3)
+        self.assertEqual(k.shape, (6, 2))
+        self.assertIsNone(assert_allclose(k[1], [0.0, 2.0 * np.pi / 3]))
+        self.assertIsNone(assert_allclose(k[3], [np.pi, 0.0]))
+
+    def test_band_structure(self):
+        lattice = Graphene(1, 4, orbitals=2, rashba_soc=True)
+        k = tightb.bands.k_grid(5, 5)
+        with patch("tightb.bands.chunk_kpoints", 7):
+            energies = tightb.bands.band_structure(lattice, k, rsoc=0.2)
+
+        self.assertEqual(energies.shape, (25, 8))
+        self.assertIsNone(
+                assert_allclose(
+                        energies,
+                        np.linalg.eigvalsh(
+                                lattice.bloch_hamiltonian(k, rsoc=0.2))))
+
+    def test_energy_bound(self):
+        self.assertAlmostEqual(tightb.bands.energy_bound(Graphene(1, 4)), 3.0)
+
+    def test_density_of_states(self):
+        lattice = Graphene(1, 4)
+        k = tightb.bands.k_grid(12, 12)
+        with patch("tightb.bands.chunk_kpoints", 50):
+            dos, edges = tightb.bands.density_of_states(lattice, k, bins=30)
+            parallel_dos, _ = tightb.bands.density_of_states(lattice,
+                                                             k,
+                                                             bins=30,
+                                                             jobs=2)
+
+        self.assertIsNone(assert_allclose(np.sum(dos * np.diff(edges)), 1.0))
+        self.assertIsNone(assert_allclose(dos, parallel_dos))
+
+        energies = tightb.bands.band_structure(lattice, k)
+        counts, _ = np.histogram(energies, bins=edges)
+        expected = counts / (energies.size * np.diff(edges))
+        self.assertIsNone(assert_allclose(dos, expected))
@@ -0,0 +1,115 @@
+# tightb generate tight-binding hamiltoniann crystalline structures
+# Copyright (C) 2021  Matheus S. M. Sousa
+#
+# This file is part of tightb.
+#
+# tightb is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# tightb is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with tightb.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from numpy.testing import assert_allclose
+from tightb.tightb import Graphene, argument_scaffolding
+from tightb.cache import Cache, cached_hamiltonian
+from tightb.cli import argument_parser, parse_arguments
+
+
+def write(content):
+    def produce(path):
+        with open(path, 'w') as stream:
+            stream.write(content)
+
+    return produce
+
+
+class test_Cache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_key(self):
+        cache = Cache(self.directory.name)
+        self.assertEqual(cache.key(dx=2, dy=4), cache.key(dy=4, dx=2))
+        self.assertNotEqual(cache.key(dx=2, dy=4), cache.key(dx=4, dy=2))
+
+    def test_get_put(self):
+        cache = Cache(self.directory.name)
+        self.assertIsNone(cache.get('a', 'output'))
+
+        path = cache.put('a', 'output', write("hamiltonian"))
+        self.assertEqual(path, cache.get('a', 'output'))
+        with open(path) as stream:
+            self.assertEqual(stream.read(), "hamiltonian")
+
+        # A concurrent job storing the same entry keeps the first one
+        cache.put('a', 'output', write("other"))
+        with open(cache.get('a', 'output')) as stream:
+            self.assertEqual(stream.read(), "hamiltonian")
+        self.assertEqual(os.listdir(self.directory.name), ['a'])
+
+    def test_evict(self):
+        cache = Cache(self.directory.name, max_bytes=25)
+        for time, key in enumerate(['a', 'b']):
+            cache.put(key, 'output', write("0123456789"))
+            os.utime(os.path.join(self.directory.name, key), (time, time))
+
+        cache.get('a', 'output')
+        cache.put('c', 'output', write("0123456789"))
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         ['a', 'c'])
+
+    def test_cached_hamiltonian(self):
+        cache = Cache(self.directory.name)
+        lattice = Graphene(2, 4, orbitals=2, external_mag=True)
+        matrix = cached_hamiltonian(cache, lattice, j_ex=0.5, theta=1.0)
+
+        with patch.object(Graphene, 'hamiltonian') as hamiltonian:
+            cached = cached_hamiltonian(cache,
+                                        Graphene(2,
+                                                 4,
+                                                 orbitals=2,
+                                                 external_mag=True),
+                                        j_ex=0.5,
+                                        theta=1)
+            hamiltonian.assert_not_called()
+
+        self.assertIsNone(assert_allclose(cached.toarray(), matrix.toarray()))
+        self.assertEqual(len(os.listdir(self.directory.name)), 1)
+
+
+class test_cached_output(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def generate(self, *argv):
+        output = os.path.join(self.directory.name, 'output.f90')
+        argument_scaffolding(
+                parse_arguments(argument_parser(), [
+                        '--lattice', 'graphene', '--dx', '2', '--dy', '4',
+                        '--output', output
+                ] + list(argv)))
+        with open(output) as stream:
+            return stream.read()
+
+    def test_evicted_after_put(self):
+        expected = self.generate()
+
+        # Another job evicts the entry as soon as it is stored
+        with patch.object(Cache, 'put', return_value=None):
+            self.assertEqual(
+                    self.generate('--cache',
+                                  os.path.join(self.directory.name, 'cache')),
+                    expected)
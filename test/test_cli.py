@@ -0,0 +1,63 @@
+# tightb generate tight-binding hamiltoniann crystalline structures
+# Copyright (C) 2021  Matheus S. M. Sousa
+#
+# This file is part of tightb.
+#
+# tightb is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# tightb is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with tightb.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from tightb.cli import argument_parser, batch_scaffolding, parse_arguments
+
+
+def parse(argv):
+    with contextlib.redirect_stderr(io.StringIO()):
+        return parse_arguments(argument_parser(), argv)
+
+
+class test_parse_arguments(unittest.TestCase):
+    def test_remove_sites(self):
+        argv = ['--lattice', 'graphene', '--dx', '2', '--dy', '4']
+        self.assertEqual(parse(argv + ['--remove-sites', '1',
+                                       '8']).remove_sites, [1, 8])
+        for site in ['0', '9', '100']:
+            with self.assertRaises(SystemExit):
+                parse(argv + ['--remove-sites', site])
+
+
+class test_batch_scaffolding(unittest.TestCase):
+    def test_invalid_line(self):
+        # Every line is checked before anything is generated
+        with tempfile.TemporaryDirectory() as directory:
+            first = os.path.join(directory, 'first.f90')
+            path = os.path.join(directory, 'batch.jsonl')
+            with open(path, 'w') as stream:
+                for configuration in [
+                        dict(lattice='graphene', dx=2, dy=4, output=first),
+                        dict(lattice='graphene',
+                             dx=2,
+                             dy=4,
+                             remove_sites=[9],
+                             output=os.path.join(directory, 'second.f90'))
+                ]:
+                    stream.write(json.dumps(configuration) + '\n')
+
+            with self.assertRaises(SystemExit):
+                with contextlib.redirect_stderr(io.StringIO()):
+                    batch_scaffolding([path])
+            self.assertFalse(os.path.exists(first))
@@ -0,0 +1,85 @@
+# tightb generate tight-binding hamiltoniann crystalline structures
+# Copyright (C) 2021  Matheus S. M. Sousa
+#
+# This file is part of tightb.
+#
+# tightb is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# tightb is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with tightb.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+from tightb.tightb import Graphene
+import tightb.kpm
+
+
+def integrate(density, energies):
+    return np.sum((density[..., 1:] + density[..., :-1]) * np.diff(energies),
+                  axis=-1) / 2.0
+
+
+class test_kpm(unittest.TestCase):
+    def test_kpm_hamiltonian(self):
+        lattice = Graphene(2, 4, sites_removed=[3, 6])
+        matrix, kept, scale = tightb.kpm.kpm_hamiltonian(lattice)
+
+        self.assertEqual(matrix.shape, (6, 6))
+        self.assertEqual(kept.tolist(), [0, 1, 3, 4, 6, 7])
+        self.assertLess(np.abs(np.linalg.eigvalsh(matrix.toarray())).max(),
+                        1.0)
+
+    def test_kpm_hamiltonian_needs_tiling(self):
+        with self.assertRaises(ValueError):
+            tightb.kpm.kpm_hamiltonian(Graphene(3, 6))
+        with self.assertRaises(ValueError):
+            tightb.kpm.density_of_states(Graphene(3, 6), moments=16)
+
+    def test_chebyshev_moments(self):
+        lattice = Graphene(2, 8, orbitals=2, rashba_soc=True)
+        matrix, kept, _ = tightb.kpm.kpm_hamiltonian(lattice, rsoc=0.3)
+        energies = np.linalg.eigvalsh(matrix.toarray())
+
+        mu = tightb.kpm.chebyshev_moments(
+                matrix, np.eye(len(kept), dtype=complex), 9)
+        expected = [
+                np.sum(np.cos(n * np.arccos(energies))) for n in range(9)
+        ]
+        self.assertIsNone(assert_allclose(mu.sum(axis=1), expected,
+                                          atol=1e-12))
+
+    def test_density_of_states(self):
+        lattice = Graphene(4, 8, sites_removed=[5])
+        dos, energies = tightb.kpm.density_of_states(lattice,
+                                                     moments=64,
+                                                     random_vectors=6,
+                                                     seed=1)
+        parallel_dos, _ = tightb.kpm.density_of_states(lattice,
+                                                       moments=64,
+                                                       random_vectors=6,
+                                                       jobs=2,
+                                                       seed=1)
+
+        self.assertIsNone(assert_allclose(dos, parallel_dos))
+        self.assertAlmostEqual(integrate(dos, energies), 1.0, places=3)
+
+    def test_local_density_of_states(self):
+        lattice = Graphene(4, 8, sites_removed=[5])
+        ldos, energies = tightb.kpm.local_density_of_states(lattice, [1, 2],
+                                                            moments=64)
+
+        self.assertEqual(ldos.shape, (2, 128))
+        self.assertIsNone(
+                assert_allclose(integrate(ldos, energies), 1.0,
+                                atol=1e-3))
+        with self.assertRaises(ValueError):
+            tightb.kpm.local_density_of_states(lattice, [5])
@@ -0,0 +1,102 @@
+# tightb generate tight-binding hamiltoniann crystalline structures
+# Copyright (C) 2021  Matheus S. M. Sousa
+#
+# This file is part of tightb.
+#
+# tightb is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# tightb is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with tightb.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from io import StringIO
+from unittest.mock import patch
+import numpy as np
+from tightb.profiling import Profile
+from tightb.tightb import Graphene
+from tightb.writers import FortranWriter
+
+
+class test_Profile(unittest.TestCase):
+    def test_phase(self):
+        profile = Profile()
+        for _ in range(2):
+            with profile.phase("outer"):
+                profile.count(elements=3)
+                with profile.phase("inner"):
+                    profile.count(elements=1, bytes=10)
+
+        report = {record['phase']: record for record in profile.report()}
+        self.assertEqual(list(report), ["outer", "inner"])
+        self.assertEqual(report["outer"]['calls'], 2)
+        self.assertEqual(report["outer"]['elements'], 8)
+        self.assertEqual(report["outer"]['bytes'], 20)
+        self.assertEqual(report["inner"]['elements'], 2)
+        self.assertGreaterEqual(report["outer"]['seconds'],
+                                report["inner"]['seconds'])
+        self.assertGreaterEqual(report["inner"]['peak_bytes'], 0)
+
+    def test_peak_bytes(self):
+        profile = Profile()
+        kept = np.ones(1 << 20)
+        with profile.phase("outer"):
+            with profile.phase("allocating"):
+                np.ones(1 << 20).sum()
+            with profile.phase("idle"):
+                pass
+
+        report = {record['phase']: record for record in profile.report()}
+        for phase in ["outer", "allocating"]:
+            self.assertGreaterEqual(report[phase]['peak_bytes'], 8 << 20)
+        self.assertLess(report["idle"]['peak_bytes'], 1 << 20)
+        self.assertEqual(kept.size, 1 << 20)
+
+    def test_lattice(self):
+        profile = Profile()
+        stream = StringIO()
+        lattice = Graphene(2,
+                           4,
+                           writer=FortranWriter(profile.stream(stream),
+                                                buffer_size=1),
+                           orbitals=2,
+                           rashba_soc=True,
+                           sites_removed=[3],
+                           profile=profile)
+        lattice.project_out_sites()
+        lattice.lattice(*lattice.terms())
+        lattice.writer.flush()
+
+        report = {record['phase']: record for record in profile.report()}
+        self.assertEqual(report["formatting"]['elements'], 2 + 2 * 16 * 3)
+        self.assertEqual(report["Nearest neighbors interaction"]['elements'],
+                         16 * 3)
+        self.assertEqual(report["output"]['bytes'], len(stream.getvalue()))
+
+    def test_lattice_jobs(self):
+        reports = []
+        for jobs in [1, 2]:
+            profile = Profile()
+            lattice = Graphene(4,
+                               8,
+                               writer=FortranWriter(StringIO()),
+                               orbitals=2,
+                               rashba_soc=True,
+                               profile=profile)
+            with patch("tightb.tightb.chunk_orbitals", 16):
+                with profile.phase("lattice"):
+                    lattice.lattice(*lattice.terms(), jobs=jobs)
+            reports.append({
+                    record['phase']: record['elements']
+                    for record in profile.report()
+            })
+        self.assertEqual(reports[0], reports[1])
+        self.assertEqual(reports[1]["formatting"], 2 * 64 * 3)
+        self.assertEqual(reports[1]["lattice"], 2 * 64 * 3)
@@ -0,0 +1,132 @@
+# tightb generate tight-binding hamiltoniann crystalline structures
+# Copyright (C) 2021  Matheus S. M. Sousa
+#
+# This file is part of tightb.
+#
+# tightb is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# tightb is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with tightb.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+from io import BytesIO, StringIO
+from unittest.mock import patch
+from tightb.client import client, request
+from tightb.server import GeneratorServer, GeometryTables, table_bytes
+from tightb.tightb import Graphene
+from tightb.writers import FortranWriter
+
+
+class test_GeometryTables(unittest.TestCase):
+    def test_setdefault(self):
+        tables = GeometryTables(1 << 20)
+        first = tables.setdefault((1, 4, 1), {})
+        tables.setdefault((2, 4, 1), {})
+        self.assertIs(tables.setdefault((1, 4, 1), {}), first)
+        self.assertEqual(list(tables), [(2, 4, 1), (1, 4, 1)])
+
+    def test_trim(self):
+        lattice = Graphene(2, 4)
+        size = table_bytes({(0, 2): lattice.neighbor_table()})
+        self.assertEqual(size, 112 * 8)
+
+        tables = GeometryTables(2 * size)
+        for geometry in [(1, 4, 1), (2, 4, 1), (3, 4, 1)]:
+            lattice.tables = tables.setdefault(geometry, {})
+            lattice.neighbor_table(range(2))
+        self.assertEqual(tables.nbytes(), 3 * size)
+
+        tables.trim()
+        self.assertEqual(list(tables), [(2, 4, 1), (3, 4, 1)])
+
+        # A geometry alone over the bound is dropped too
+        tables.max_bytes = size // 2
+        tables.trim()
+        self.assertFalse(tables)
+
+
+class test_GeneratorServer(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'tightb.sock')
+
+        server = GeneratorServer(self.path, 1 << 20)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        self.server = server
+
+    def test_request(self):
+        lattice = Graphene(2,
+                           4,
+                           writer=FortranWriter(),
+                           orbitals=2,
+                           rashba_soc=True,
+                           sites_removed=[3])
+        lattice.writer.comment("Sites projected out")
+        lattice.project_out_sites()
+        lattice.lattice(*lattice.terms())
+
+        for _ in range(2):
+            stdout = BytesIO()
+            status = request([
+                    '--lattice', 'graphene', '--dx', '2', '--dy', '4',
+                    '--orbitals', '2', '--rashba-soc', '--remove-sites', '3'
+            ], self.path, stdout)
+            self.assertEqual(status, 0)
+            self.assertEqual(stdout.getvalue().decode(),
+                             lattice.writer.toString())
+        self.assertEqual(list(self.server.geometry_tables), [(2, 4, 2)])
+
+    def test_request_error(self):
+        stderr = BytesIO()
+        status = request(['--lattice', 'graphene', '--dx', '2'],
+                         self.path,
+                         stderr=stderr)
+        self.assertEqual(status, 2)
+        self.assertIn(b"required: --dy", stderr.getvalue())
+
+    def test_request_batch_stdin(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'output.f90')
+            stdin = StringIO(
+                    json.dumps(
+                            dict(lattice='graphene', dx=2, dy=4,
+                                 output=output)) + '\n')
+            status = request(['batch', '-'], self.path, BytesIO(), BytesIO(),
+                             stdin)
+            self.assertEqual(status, 0)
+            self.assertTrue(os.path.exists(output))
+
+        # Without any standard input sent, the server reads an empty one
+        # instead of blocking on its own
+        self.assertEqual(request(['batch', '-'], self.path, BytesIO(),
+                                 BytesIO(), StringIO()), 0)
+
+
+class test_client(unittest.TestCase):
+    def test_connection_lost(self):
+        stderr = StringIO()
+        with patch('tightb.client.request',
+                   side_effect=ConnectionError("closed")), \
+                patch('sys.argv', ['tightb_client.py', '--dx', '2']), \
+                patch('sys.stderr', stderr):
+            with self.assertRaises(SystemExit) as exit:
+                client()
+        self.assertEqual(exit.exception.code, 1)
+        self.assertIn("error: closed", stderr.getvalue())
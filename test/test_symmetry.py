@@ -144,6 +144,14 @@ class graphene_lattice_real_coordinates(unittest.TestCase):
                                   [4.5, 2.598076211353316], [5.0, 0.0],
                                   [5.0, 1.7320508075688774]])))
 
+    def test_array(self):
+        removed = [1, 6, 100]
+        coordinates = tightb.symmetry.graphene_lattice_real_coordinates(
+                3, 2, removed)
+        self.assertEqual(coordinates.shape, (22, 2))
+        self.assertTrue(coordinates.flags['C_CONTIGUOUS'])
+        self.assertTrue(np.all(np.diff(coordinates[:, 0]) >= 0.0))
+
 
 class reflect_point_by_vertical_axis(unittest.TestCase):
     def test_trivial(self):
@@ -528,6 +536,99 @@ class is_symmetric_by_reflection_in_y_axis(unittest.TestCase):
                         lattice, v, r_star, boundary))
 
 
+class array_transforms(unittest.TestCase):
+    def test_wrap(self):
+        boundary = tightb.symmetry.Boundary(xmin=0.0,
+                                            xmax=2.0,
+                                            ymin=-1.0,
+                                            ymax=1.0)
+        points = np.array([[0.5, 0.0], [2.0, 1.5], [-0.5, -1.5]])
+        self.assertIsNone(
+                assert_allclose(boundary.wrap(points),
+                                [[0.5, 0.0], [0.0, -0.5], [1.5, 0.5]]))
+
+    def test_matches_points(self):
+        lattice = tightb.symmetry.graphene_lattice_real_coordinates(2, 1)
+        boundary = tightb.symmetry.boundary_from_lattice(lattice, 0.25, 0.25)
+        v = np.array([1.0, 2.0])
+        r_star = [0.5, 0.3]
+
+        self.assertIsNone(
+                assert_allclose(
+                        tightb.symmetry.reflect_points_by_tilted_axis(
+                                lattice, v, r_star, boundary), [
+                                        tightb.symmetry.
+                                        reflect_point_by_tilted_axis(
+                                                x0, v, r_star, boundary)
+                                        for x0 in lattice
+                                ]))
+        self.assertIsNone(
+                assert_allclose(
+                        tightb.symmetry.
+                        translate_points_in_direction_by_amount(
+                                lattice, v, 0.7, boundary), [
+                                        tightb.symmetry.
+                                        translate_point_in_direction_by_amount(
+                                                x0, v, 0.7, boundary)
+                                        for x0 in lattice
+                                ]))
+
+
+class axis_candidates(unittest.TestCase):
+    def test_coordinate_profile(self):
+        self.assertIsNone(
+                assert_allclose(
+                        tightb.symmetry.coordinate_profile(
+                                [3.0, 1.0 + 1e-12, 0.0, 1.0]),
+                        [[0.0, 1.0], [1.0, 2.0], [3.0, 1.0]]))
+
+    def test_periodic_candidates(self):
+        self.assertIsNone(
+                assert_allclose(
+                        tightb.symmetry.periodic_candidates(
+                                [0.5, 0.5 + 1e-12, 1.0], 0.0, 2.0, 1.5),
+                        [0.5, 1.0, 2.0]))
+
+    def test_reflection_axis_candidates(self):
+        self.assertIsNone(
+                assert_allclose(
+                        tightb.symmetry.reflection_axis_candidates(
+                                [-2.0, -1.0, 1.0, 2.0], -2.0, 2.0),
+                        [-2.0, 0.0, 2.0]))
+        self.assertFalse(
+                len(
+                        tightb.symmetry.reflection_axis_candidates(
+                                [-2.0, -1.5, 1.0, 2.5], -2.0, 2.5)))
+
+
+class LatticeIndex(unittest.TestCase):
+    def test_contains(self):
+        index = tightb.symmetry.LatticeIndex([[0.0, 0.0], [1.0, 0.5],
+                                              [-2.0, 3.0]])
+        self.assertEqual(
+                index.contains([[1.0 + 5e-9, 0.5 - 5e-9], [-2.0, 3.0 + 2e-8],
+                                [0.0, -1e-12], [0.5, 0.5]]).tolist(),
+                [True, False, True, False])
+
+    def test_matches(self):
+        lattice = tightb.symmetry.graphene_lattice_real_coordinates(2, 2)
+        index = tightb.symmetry.LatticeIndex(lattice)
+        self.assertTrue(index.matches(lattice[::-1] + 1e-10))
+        self.assertFalse(index.matches(lattice[1:]))
+        self.assertFalse(index.matches(lattice + [0.5, 0.0]))
+
+    def test_unsorted_reflection(self):
+        lattice = [
+                np.array([2.0, 0.0]),
+                np.array([-1.0, 0.0]),
+                np.array([1.0, 0.0]),
+                np.array([-2.0, 0.0])
+        ]
+        self.assertTrue(
+                tightb.symmetry.is_symmetric_by_reflection(
+                        lattice, np.array([0.0, 1.0]), np.array([0.0, 0.0])))
+
+
 class reflection_vertical_axis(unittest.TestCase):
     def test_centered_symmetric(self):
         lattice = [
@@ -603,6 +704,16 @@ class reflection_vertical_axis(unittest.TestCase):
                                 [[-0.25, 0.0], [2.5, 0.0], [5.25, 0.0]],
                                 atol=1e-15))
 
+    def test_graphene_three_by_one(self):
+        lattice = tightb.symmetry.graphene_lattice_real_coordinates(3, 1)
+        boundary = tightb.symmetry.boundary_from_lattice(
+                lattice, 0.25, 0.25 * np.sqrt(3.0))
+        self.assertIsNone(
+                assert_allclose(tightb.symmetry.vertical_reflection_axis(
+                        lattice, boundary),
+                                [[-0.25, 0.0], [4.0, 0.0], [8.25, 0.0]],
+                                atol=1e-15))
+
     def test_graphene_glide_reflection(self):
         removed = [3, 4, 23, 24]
         lattice = tightb.symmetry.graphene_lattice_real_coordinates(
@@ -702,6 +813,17 @@ class reflection_horizontal_axis(unittest.TestCase):
                                              [0.0, 1.25 * np.sqrt(3.0)]],
                                 atol=1e-15))    # Equal up to 1e-16
 
+    def test_graphene_one_by_three(self):    # Missed by a uniform grid
+        lattice = tightb.symmetry.graphene_lattice_real_coordinates(1, 3)
+        boundary = tightb.symmetry.boundary_from_lattice(
+                lattice, 0.25, 0.25 * np.sqrt(3.0))
+        self.assertIsNone(
+                assert_allclose(tightb.symmetry.horizontal_reflection_axis(
+                        lattice, boundary),
+                                [[0.0, 0.5 * j * np.sqrt(3.0)]
+                                 for j in range(6)],
+                                atol=1e-15))
+
     def test_graphene_glide_reflection(self):    # Wrong @@@
         removed = [3, 4, 23, 24]
         lattice = tightb.symmetry.graphene_lattice_real_coordinates(
@@ -845,6 +967,27 @@ class glide_operation(unittest.TestCase):
                         tightb.symmetry.vertical_glide_axis(lattice, boundary),
                         [[-1.5, 0.0], [0.0, 0.0], [1.5, 0.0]]))
 
+    def test_graphene_vertical_glide_axis(self):
+        # Each axis glides by zero and by a lattice vector, neither of which
+        # lies on a uniform grid of shifts
+        lattice = tightb.symmetry.graphene_lattice_real_coordinates(2, 2)
+        boundary = tightb.symmetry.boundary_from_lattice(
+                lattice, 0.25, 0.25 * np.sqrt(3.0))
+        self.assertIsNone(
+                assert_allclose(
+                        tightb.symmetry.vertical_glide_axis(lattice, boundary),
+                        [[-0.25, 0.0], [-0.25, 0.0], [2.5, 0.0], [2.5, 0.0],
+                         [5.25, 0.0], [5.25, 0.0]],
+                        atol=1e-15))
+
+    def test_single_site(self):
+        lattice = np.array([[0.0, 0.0]])
+        boundary = tightb.symmetry.boundary_from_lattice(lattice)
+        self.assertIsNone(
+                assert_allclose(
+                        tightb.symmetry.vertical_glide_axis(lattice, boundary),
+                        [[0.0, 0.0]]))
+
     def test_horizontal_glide_axis(self):
         lattice = np.array([[0.0, 1.0], [1.0, -1.0]])
         boundary = tightb.symmetry.Boundary(xmin=-0.5,
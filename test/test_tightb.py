@@ -17,9 +17,13 @@
 # along with tightb.  If not, see <https://www.gnu.org/licenses/>.
 
 import unittest
+import warnings
+from unittest.mock import patch
 import numpy as np
-from numpy.testing import assert_array_equal
-from tightb.tightb import Graphene
+import scipy.sparse
+from numpy.testing import assert_allclose, assert_array_equal
+from tightb.tightb import Graphene, removed_site_penalty
+from tightb.writers import FortranWriter
 
 
 class test_Graphene(unittest.TestCase):
@@ -135,6 +139,18 @@ class test_Graphene(unittest.TestCase):
         self.assertTrue(lattice.is_removed([2, 5]))
         self.assertFalse(lattice.is_removed([5, 6]))
 
+    def test_is_removed_with_orbitals(self):
+        lattice = Graphene(2, 4, orbitals=2, sites_removed=[3, 3, 1])
+        self.assertEqual(lattice.sites_removed, [1, 2, 5, 6])
+        self.assertTrue(lattice.is_removed([4, 6]))
+        self.assertFalse(lattice.is_removed([3, 4]))
+
+    def test_removed_out_of_bounds(self):
+        with self.assertRaises(ValueError):
+            Graphene(2, 4, sites_removed=[9])
+        with self.assertRaises(ValueError):
+            Graphene(2, 4, sites_removed=[0])
+
     def test_check_removed(self):
         lattice = Graphene(2, 4, sites_removed=[1, 2, 3, 4])
 
@@ -143,3 +159,335 @@ class test_Graphene(unittest.TestCase):
 
         check = lattice.check_removed([5, 6], "foo")
         self.assertEqual(check, "foo")
+
+    def test_neighbor_table(self):
+        lattice = Graphene(2, 4, orbitals=2)
+        table = lattice.neighbor_table()
+
+        self.assertIsNone(assert_array_equal(table.source, np.arange(16)))
+        self.assertIsNone(
+                assert_array_equal(table.site_kind,
+                                   [0, 0, 1, 1, 2, 2, 3, 3] * 2))
+
+        for x0_coordinate in table.source:
+            x0 = np.array(divmod(x0_coordinate, lattice.orbitals * lattice.dy))
+            Site = lattice.sites[table.site_kind[x0_coordinate]]
+            for delta, direction, target, target_direction in zip(
+                    Site.delta, Site.direction, table.target[x0_coordinate],
+                    table.direction[x0_coordinate]):
+                x = lattice.periodic(x0, delta)
+                self.assertEqual(target, lattice.convert_coordinates(x))
+                self.assertEqual(target_direction, direction)
+
+    def test_spinless_elements_removed(self):
+        lattice = Graphene(2, 4, sites_removed=[1])
+        elements = lattice.check_removed_elements(
+                lattice.spinless_elements(lattice.neighbor_table()))
+
+        self.assertEqual(elements.name, "tij1")
+        self.assertIsNone(assert_array_equal(elements.row[0], [1, 1, 1]))
+        self.assertIsNone(assert_array_equal(elements.col[0], [2, 6, 4]))
+        result = lattice.expressions.lookup(elements.result)
+        self.assertIsNone(
+                assert_array_equal(result[0], ["0.0", "0.0", "0.0"]))
+        self.assertIsNone(assert_array_equal(result[1], ["0.0", "t", "t"]))
+
+    def test_hamiltonian_spinless(self):
+        lattice = Graphene(4, 8)
+        hamiltonian = lattice.hamiltonian(t=1.0)
+
+        self.assertEqual(hamiltonian.shape, (32, 32))
+        self.assertEqual(hamiltonian.nnz, 3 * 32)
+
+        energies = np.linalg.eigvalsh(hamiltonian.toarray())
+        self.assertAlmostEqual(energies.min(), -3.0)
+        self.assertAlmostEqual(energies.max(), 3.0)
+
+    def test_hamiltonian_is_hermitian(self):
+        lattice = Graphene(4,
+                           8,
+                           orbitals=2,
+                           rashba_soc=True,
+                           external_mag=True)
+        hamiltonian = lattice.hamiltonian(t=1.0,
+                                          rsoc=0.1,
+                                          j_ex=0.2,
+                                          theta=0.3,
+                                          phi=0.4,
+                                          format='coo').toarray()
+        self.assertIsNone(assert_allclose(hamiltonian, hamiltonian.conj().T))
+        self.assertAlmostEqual(hamiltonian[0, 0], 0.2 * np.cos(0.3))
+        self.assertAlmostEqual(hamiltonian[0, 1],
+                               0.2 * np.sin(0.3) * np.exp(-0.4j))
+
+    def test_hamiltonian_chunks(self):
+        # Removed sites make the first chunk smaller than the next ones
+        lattice = Graphene(4,
+                           8,
+                           orbitals=2,
+                           rashba_soc=True,
+                           external_mag=True,
+                           sites_removed=[1, 2, 3])
+        parameters = dict(rsoc=0.3, j_ex=0.2, theta=0.4, phi=0.1)
+        for keep_zeros in [False, True]:
+            expected = lattice.hamiltonian(keep_zeros=keep_zeros,
+                                           **parameters)
+            with patch("tightb.tightb.chunk_orbitals", 32):
+                matrix = lattice.hamiltonian(keep_zeros=keep_zeros,
+                                             **parameters)
+            self.assertIsNone(assert_array_equal(matrix.indptr,
+                                                 expected.indptr))
+            self.assertIsNone(
+                    assert_array_equal(matrix.indices, expected.indices))
+            self.assertIsNone(assert_array_equal(matrix.data, expected.data))
+
+    def test_hamiltonian_removed_sites(self):
+        lattice = Graphene(2, 4, sites_removed=[1])
+        hamiltonian = lattice.hamiltonian(t=1.0).toarray()
+
+        self.assertEqual(hamiltonian[0, 0], removed_site_penalty)
+        self.assertFalse(hamiltonian[0, 1:].any())
+        self.assertFalse(hamiltonian[1:, 0].any())
+
+    def test_hamiltonian_needs_two_orbitals(self):
+        lattice = Graphene(2, 4, rashba_soc=True)
+        with self.assertRaises(ValueError):
+            lattice.hamiltonian()
+
+    def test_hamiltonian_needs_tiling(self):
+        for dx, dy in [(3, 6), (3, 5), (5, 5)]:
+            lattice = Graphene(dx, dy)
+            with self.assertRaises(ValueError):
+                lattice.hamiltonian()
+            with self.assertRaises(ValueError):
+                lattice.bloch_hamiltonian([0.0, 0.0])
+
+    def test_update_removed(self):
+        parameters = dict(rsoc=0.3, j_ex=0.2, theta=0.4, phi=0.1)
+        options = dict(orbitals=2, rashba_soc=True, external_mag=True)
+        lattice = Graphene(6, 8, sites_removed=[3], **options)
+        matrix = lattice.update_removed(lattice.hamiltonian(keep_zeros=True,
+                                                            **parameters),
+                                        remove=[5, 17],
+                                        restore=[3],
+                                        **parameters)
+
+        self.assertEqual(lattice.sites_removed, [9, 10, 33, 34])
+        expected = Graphene(6, 8, sites_removed=[5, 17],
+                            **options).hamiltonian(**parameters)
+        self.assertIsNone(
+                assert_allclose(matrix.toarray(), expected.toarray()))
+
+        restored = lattice.update_removed(matrix,
+                                          restore=[5, 17],
+                                          **parameters)
+        self.assertIs(restored, matrix)
+        expected = Graphene(6, 8, **options).hamiltonian(**parameters)
+        self.assertIsNone(
+                assert_allclose(restored.toarray(), expected.toarray()))
+
+        with self.assertRaises(ValueError):
+            lattice.update_removed(matrix, remove=[50], **parameters)
+
+    def test_update_removed_in_place(self):
+        lattice = Graphene(4, 8, orbitals=2, rashba_soc=True)
+        matrix = lattice.hamiltonian(rsoc=0.3, keep_zeros=True)
+        indptr, indices = matrix.indptr.copy(), matrix.indices.copy()
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error',
+                                  scipy.sparse.SparseEfficiencyWarning)
+            lattice.update_removed(matrix, remove=[7], rsoc=0.3)
+        self.assertEqual(matrix.nnz, indices.size)
+        self.assertIsNone(assert_array_equal(matrix.indptr, indptr))
+        self.assertIsNone(assert_array_equal(matrix.indices, indices))
+        self.assertIsNone(
+                assert_allclose(
+                        matrix.toarray(),
+                        Graphene(4,
+                                 8,
+                                 orbitals=2,
+                                 rashba_soc=True,
+                                 sites_removed=[7]).hamiltonian(
+                                         rsoc=0.3).toarray()))
+
+    def test_eigenpairs(self):
+        lattice = Graphene(6,
+                           12,
+                           orbitals=2,
+                           rashba_soc=True,
+                           sites_removed=[3, 10])
+        values, vectors = lattice.eigenpairs(6, target=0.1, rsoc=0.3)
+
+        matrix = lattice.hamiltonian(rsoc=0.3).toarray()
+        energies = np.linalg.eigvalsh(matrix)
+        closest = np.sort(energies[np.argsort(np.abs(energies - 0.1))[:6]])
+        self.assertIsNone(assert_allclose(values, closest))
+        self.assertIsNone(
+                assert_allclose(matrix @ vectors, vectors * values,
+                                atol=1e-12))
+        self.assertIsNone(assert_array_equal(vectors[[4, 5, 18, 19]], 0.0))
+
+    def test_eigenpairs_singular_target(self):
+        lattice = Graphene(3, 4, sites_removed=[2, 5, 8])
+        values, _ = lattice.eigenpairs(3)
+        self.assertIsNone(assert_allclose(values[1], 0.0, atol=1e-12))
+        with self.assertRaises(ValueError):
+            lattice.eigenpairs(10)
+
+    def test_eigenpairs_needs_tiling(self):
+        with self.assertRaises(ValueError):
+            Graphene(3, 6).eigenpairs(4)
+
+    def test_lattice_sections(self):
+        writer = FortranWriter()
+        lattice = Graphene(2,
+                           4,
+                           orbitals=2,
+                           rashba_soc=True,
+                           external_mag=True,
+                           writer=writer)
+        lattice.lattice(*lattice.terms())
+        output = writer.toString()
+
+        self.assertEqual(
+                [line for line in output.splitlines() if "nteraction" in line],
+                [
+                        "! Nearest neighbors interaction",
+                        "! Rashba Spin Orbit Interaction",
+                        "! Exchange Interaction"
+                ])
+        self.assertLess(output.rindex("tij1"), output.index("tij2"))
+        self.assertLess(output.rindex("tij2"), output.index("tij3"))
+
+        chunked_writer = FortranWriter()
+        lattice.writer = chunked_writer
+        with patch("tightb.tightb.chunk_orbitals", 4):
+            lattice.lattice(*lattice.terms())
+        self.assertEqual(chunked_writer.toString(), output)
+
+    def test_lattice_loops(self):
+        writer = FortranWriter()
+        lattice = Graphene(2, 4, sites_removed=[2], writer=writer)
+        lattice.lattice_loops(*lattice.terms())
+        lines = writer.toString().splitlines()
+
+        self.assertEqual(lines[:3], [
+                "! Nearest neighbors interaction", "do ix = 0, 1",
+                "  do iy = 0, 3, 4"
+        ])
+        self.assertIn("    tij1(1, ix*4 + iy + 1, ix*4 + iy + 2) = t", lines)
+        self.assertIn(
+                "    tij1(-3, ix*4 + iy + 4, "
+                "ix*4 + modulo(iy + 4, 4) + 1) = t", lines)
+        self.assertEqual(lines[lines.index("! Bonds of removed sites") + 1:],
+                         [
+                                 "tij1(1, 1, 2) = 0.0",
+                                 "tij1(-1, 2, 1) = 0.0",
+                                 "tij1(-2, 2, 5) = 0.0",
+                                 "tij1(-3, 2, 3) = 0.0",
+                                 "tij1(3, 3, 2) = 0.0",
+                                 "tij1(2, 5, 2) = 0.0",
+                         ])
+
+    def test_lattice_loops_fallback(self):
+        writer = FortranWriter()
+        lattice = Graphene(2, 6, writer=writer)
+        lattice.lattice_loops(*lattice.terms())
+
+        expected = FortranWriter()
+        lattice.writer = expected
+        lattice.lattice(*lattice.terms())
+        self.assertEqual(writer.toString(), expected.toString())
+
+        with patch.object(Graphene, 'lattice') as explicit:
+            lattice.lattice_loops(*lattice.terms(), jobs=2)
+        explicit.assert_called_once_with(*lattice.terms(), jobs=2)
+
+    def test_intern_expressions(self):
+        writer = FortranWriter(intern=True)
+        lattice = Graphene(2,
+                           4,
+                           orbitals=2,
+                           rashba_soc=True,
+                           sites_removed=[1],
+                           writer=writer)
+        writer.expression_table(lattice.expressions)
+        lattice.project_out_sites()
+        lattice.lattice(*lattice.terms())
+        lines = writer.toString().splitlines()
+
+        expressions = list(lattice.expressions)
+        self.assertEqual(lines[0],
+                         f"! Expressions, expr(0:{len(expressions) - 1})")
+        self.assertEqual(lines[1:len(expressions) + 1], [
+                f"expr({id}) = {expression}"
+                for id, expression in enumerate(expressions)
+        ])
+        self.assertIn("tij0(0, 1, 1) = expr(1)", lines)
+        self.assertIn("tij1(1, 1, 3) = expr(0)", lines)
+        self.assertIn("tij1(1, 5, 15) = expr(2)", lines)
+
+    def test_lattice_jobs(self):
+        lattice = Graphene(4,
+                           4,
+                           orbitals=2,
+                           rashba_soc=True,
+                           external_mag=True,
+                           sites_removed=[2, 7])
+        outputs = []
+        for jobs in [1, 2]:
+            lattice.writer = FortranWriter()
+            with patch("tightb.tightb.chunk_orbitals", 8):
+                lattice.lattice(*lattice.terms(), jobs=jobs)
+            outputs.append(lattice.writer.toString())
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_shared_tables(self):
+        tables = {}
+        outputs = []
+        for sites_removed in [[], [2, 7]]:
+            for shared in [None, tables]:
+                lattice = Graphene(4,
+                                   4,
+                                   writer=FortranWriter(),
+                                   orbitals=2,
+                                   rashba_soc=True,
+                                   sites_removed=sites_removed,
+                                   tables=shared)
+                with patch("tightb.tightb.chunk_orbitals", 8):
+                    lattice.lattice(*lattice.terms())
+                outputs.append(lattice.writer.toString())
+
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[2], outputs[3])
+        self.assertEqual(sorted(tables), [(0, 1), (1, 2), (2, 3), (3, 4)])
+
+    def test_bloch_hamiltonian_matches_supercell(self):
+        parameters = dict(t=1.0, rsoc=0.13, j_ex=0.21, theta=0.5, phi=0.3)
+        supercell = Graphene(3,
+                             8,
+                             orbitals=2,
+                             rashba_soc=True,
+                             external_mag=True)
+        energies = np.linalg.eigvalsh(
+                supercell.hamiltonian(**parameters).toarray())
+
+        cell = Graphene(1, 4, orbitals=2, rashba_soc=True, external_mag=True)
+        k = np.array([[2.0 * np.pi * i / 3, 2.0 * np.pi * j / 2]
+                      for i in range(3) for j in range(2)])
+        bloch = cell.bloch_hamiltonian(k, **parameters)
+
+        self.assertEqual(bloch.shape, (6, 8, 8))
+        self.assertIsNone(
+                assert_allclose(bloch, bloch.conj().transpose(0, 2, 1)))
+        self.assertIsNone(
+                assert_allclose(np.sort(np.linalg.eigvalsh(bloch).ravel()),
+                                energies,
+                                atol=1e-12))
+
+    def test_bloch_hamiltonian_gamma(self):
+        cell = Graphene(1, 4)
+        self.assertIsNone(
+                assert_allclose(cell.bloch_hamiltonian([0.0, 0.0]),
+                                cell.hamiltonian().toarray()))
@@ -16,8 +16,13 @@
 # You should have received a copy of the GNU General Public License
 # along with tightb.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
+import tempfile
 import unittest
-from tightb.writers import FortranWriter
+import numpy as np
+from io import StringIO
+from numpy.testing import assert_array_equal
+from tightb.writers import FortranWriter, NumpyWriter, read_numpy
 
 
 class test_FortranWriter(unittest.TestCase):
@@ -46,3 +51,79 @@ class test_FortranWriter(unittest.TestCase):
         write = FortranWriter()
         write.matrix_element("h", 1, 2, result="1.0")
         self.assertEqual(write.toString(), "h(1, 2) = 1.0\n")
+
+    def test_stream(self):
+        stream = StringIO()
+        write = FortranWriter(stream, buffer_size=8)
+        write.append("hello")
+        self.assertEqual(stream.getvalue(), "")
+        write.append("world")
+        self.assertEqual(stream.getvalue(), "hello\nworld\n")
+        self.assertEqual(write.toString(), "")
+        write.comment("end")
+        write.flush()
+        self.assertEqual(stream.getvalue(), "hello\nworld\n! end\n")
+
+    def test_matrix_elements(self):
+        write = FortranWriter()
+        write.matrix_elements("h", [1, 2], [3, 4], result=["1.0", "t"])
+        self.assertEqual(write.toString(), "h(1, 3) = 1.0\nh(2, 4) = t\n")
+
+    def test_matrix_elements_single_index(self):
+        write = FortranWriter()
+        write.matrix_elements("h", [1], result=["1.0"])
+        self.assertEqual(write.toString(), "h(1,) = 1.0\n")
+
+    def test_matrix_elements_orbitals(self):
+        write = FortranWriter()
+        write.matrix_elements("h", [[1, 2], [-1, -2]], [[1, 1], [2, 2]],
+                              [[2, 3], [3, 4]],
+                              result=[["t", "0.0"], ["t", "t"]],
+                              orbitals=[1, 2])
+        expected = FortranWriter()
+        for orbital, direction, row, col, result in [
+                (1, [1, 2], 1, [2, 3], ["t", "0.0"]),
+                (2, [-1, -2], 2, [3, 4], ["t", "t"])]:
+            expected.comment(f"Orbital {orbital}")
+            for d, c, r in zip(direction, col, result):
+                expected.matrix_element("h", d, row, c, result=r)
+            expected.newline()
+        self.assertEqual(write.toString(), expected.toString())
+
+
+class test_NumpyWriter(unittest.TestCase):
+    def test_matrix_elements(self):
+        with tempfile.TemporaryDirectory() as directory:
+            write = NumpyWriter(directory)
+            write.comment("ignored")
+            write.matrix_elements("h", [[1, -1]], [[1, 1]], [[2, 3]],
+                                  result=[["t", "rsoc"]])
+            write.matrix_element("h0", 0, 4, 4, result=1000000.0)
+            write.close()
+
+            arrays = read_numpy(directory)
+            self.assertIsInstance(arrays['row'], np.memmap)
+            self.assertIsNone(
+                    assert_array_equal(arrays['direction'], [1, -1, 0]))
+            self.assertIsNone(assert_array_equal(arrays['row'], [1, 1, 4]))
+            self.assertIsNone(assert_array_equal(arrays['col'], [2, 3, 4]))
+            self.assertIsNone(assert_array_equal(arrays['matrix'], [0, 0, 1]))
+            self.assertIsNone(
+                    assert_array_equal(arrays['matrices'], ["h", "h0"]))
+            self.assertIsNone(
+                    assert_array_equal(
+                            arrays['expressions'][arrays['term_id']],
+                            ["t", "rsoc", "1000000.0"]))
+
+    def test_npz(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "hamiltonian.npz")
+            write = NumpyWriter(path)
+            write.matrix_elements("h", [0, 0], [1, 2], [2, 1],
+                                  result=["t", "t"])
+            write.close()
+
+            self.assertEqual(os.listdir(directory), ["hamiltonian.npz"])
+            arrays = read_numpy(path)
+            self.assertIsNone(assert_array_equal(arrays['row'], [1, 2]))
+            self.assertIsNone(assert_array_equal(arrays['term_id'], [0, 0]))
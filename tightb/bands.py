@@ -0,0 +1,114 @@
+# tightb generate tight-binding hamiltoniann crystalline structures
+# Copyright (C) 2021  Matheus S. M. Sousa
+#
+# This file is part of tightb.
+#
+# tightb is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# tightb is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with tightb.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from tightb.tightb import Graphene
+
+# Number of k-points diagonalized at once
+chunk_kpoints = 4096
+
+
+def k_grid(n1: int, n2: int) -> np.array:
+    # Uniform grid of n1 x n2 k-points in reduced coordinates, [0, 2 pi)
+    k1, k2 = np.meshgrid(2.0 * np.pi * np.arange(n1) / n1,
+                         2.0 * np.pi * np.arange(n2) / n2,
+                         indexing='ij')
+    return np.stack([k1.ravel(), k2.ravel()], axis=-1)
+
+
+def energy_bound(lattice: Graphene, **parameters) -> float:
+    # Gershgorin bound on the spectrum of H(k), valid for every k
+    parameters = dict(dict(t=1.0, rsoc=0.0, j_ex=0.0, theta=0.0, phi=0.0),
+                      **parameters)
+    rows, _, values, _ = lattice.numeric_elements(**parameters)
+    size = lattice.dx * lattice.orbitals * lattice.dy
+    return np.bincount(rows, weights=np.abs(values), minlength=size).max()
+
+
+def map_chunks(fn, lattice: Graphene, parameters: dict, k: np.array,
+               jobs: int):
+    # Apply fn to consecutive chunks of k-points, in order, on `jobs`
+    # processes
+    chunks = [
+            k[start:start + chunk_kpoints]
+            for start in range(0, len(k), chunk_kpoints)
+    ]
+    if jobs == 1:
+        init_bands_worker(lattice, parameters)
+        yield from map(fn, chunks)
+        return
+
+    with ProcessPoolExecutor(jobs,
+                             initializer=init_bands_worker,
+                             initargs=(lattice, parameters)) as pool:
+        yield from pool.map(fn, chunks)
+
+
+bands_worker_state = {}
+
+
+def init_bands_worker(lattice: Graphene, parameters: dict) -> None:
+    bands_worker_state['lattice'] = lattice
+    bands_worker_state['parameters'] = parameters
+
+
+def eigenvalues_worker(k: np.array) -> np.array:
+    lattice = bands_worker_state['lattice']
+    return np.linalg.eigvalsh(
+            lattice.bloch_hamiltonian(k, **bands_worker_state['parameters']))
+
+
+def histogram_worker(k: np.array, edges: np.array) -> np.array:
+    return np.histogram(eigenvalues_worker(k), bins=edges)[0]
+
+
+def band_structure(lattice: Graphene,
+                   k: np.array,
+                   jobs: int = 1,
+                   **parameters) -> np.array:
+    # Eigenvalues of H(k) along the k-points, shape (len(k), n)
+    k = np.asarray(k, dtype=float)
+    return np.concatenate(
+            list(map_chunks(eigenvalues_worker, lattice, parameters, k,
+                            jobs)))
+
+
+def density_of_states(lattice: Graphene,
+                      k: np.array,
+                      bins: int = 200,
+                      energy_range: tuple = None,
+                      jobs: int = 1,
+                      **parameters) -> tuple:
+    # Density of states per orbital over the k-points. Each chunk of
+    # k-points is diagonalized and reduced to a histogram straight away, so
+    # only the histogram is kept. Returns the DOS and the bin edges.
+    k = np.asarray(k, dtype=float)
+    if energy_range is None:
+        bound = energy_bound(lattice, **parameters) * (1.0 + 1e-9)
+        energy_range = (-bound, bound)
+    edges = np.linspace(*energy_range, bins + 1)
+
+    counts = np.zeros(bins)
+    for chunk_counts in map_chunks(partial(histogram_worker, edges=edges),
+                                   lattice, parameters, k, jobs):
+        counts += chunk_counts
+
+    size = lattice.dx * lattice.orbitals * lattice.dy
+    return counts / (len(k) * size * np.diff(edges)), edges
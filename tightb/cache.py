@@ -0,0 +1,145 @@
+# tightb generate tight-binding hamiltoniann crystalline structures
+# Copyright (C) 2021  Matheus S. M. Sousa
+#
+# This file is part of tightb.
+#
+# tightb is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# tightb is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with tightb.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import scipy.sparse
+
+# Bumped whenever the generated output changes, so that stale entries are
+# never served
+cache_version = 1
+
+
+class Cache:
+    # Content-addressed cache of generated Hamiltonians. Every entry is a
+    # directory named after the hash of the configuration that produced it.
+    # Entries are built in a temporary directory and renamed into place, so
+    # concurrent jobs sharing the cache never see a partial entry. The
+    # modification time of an entry records its last use, and the least
+    # recently used entries are evicted once the cache grows past
+    # `max_bytes`.
+    def __init__(self, directory: str, max_bytes: int = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, **configuration) -> str:
+        configuration = dict(configuration, version=cache_version)
+        return hashlib.sha256(
+                json.dumps(configuration,
+                           sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str, name: str) -> str:
+        # Path of the cached `name` under `key`, or None on a miss
+        entry = os.path.join(self.directory, key)
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        return os.path.join(entry, name)
+
+    def put(self, key: str, name: str, produce) -> str:
+        # produce(path) writes `name` into the entry for `key`
+        staging = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        try:
+            produce(os.path.join(staging, name))
+            os.rename(staging, os.path.join(self.directory, key))
+        except OSError:
+            # Another job stored the same entry first
+            if not os.path.isdir(os.path.join(self.directory, key)):
+                raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.evict(keep=key)
+        return self.get(key, name)
+
+    def entries(self) -> list:
+        # (last use, size in bytes, key) of every entry
+        entries = []
+        for key in os.listdir(self.directory):
+            entry = os.path.join(self.directory, key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(
+                        os.path.getsize(os.path.join(root, name))
+                        for root, _, names in os.walk(entry)
+                        for name in names)
+                entries.append((os.path.getmtime(entry), size, key))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def evict(self, keep: str = None) -> None:
+        if self.max_bytes is None:
+            return
+
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            # Renamed first, so that readers never see half removed entries
+            doomed = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+            try:
+                os.rename(os.path.join(self.directory, key),
+                          os.path.join(doomed, key))
+            except OSError:
+                # Already evicted by another job
+                pass
+            shutil.rmtree(doomed, ignore_errors=True)
+            total -= size
+
+
+def cached_hamiltonian(cache: Cache,
+                       lattice,
+                       format: str = 'csr',
+                       **parameters) -> scipy.sparse.spmatrix:
+    # lattice.hamiltonian(**parameters), read from `cache` when the same
+    # lattice and parameters were evaluated before
+    parameters = {
+            name: float(value)
+            for name, value in dict(dict(t=1.0,
+                                         rsoc=0.0,
+                                         j_ex=0.0,
+                                         theta=0.0,
+                                         phi=0.0),
+                                    **parameters).items()
+    }
+    key = cache.key(kind='hamiltonian',
+                    **lattice.configuration(),
+                    **parameters)
+
+    path = cache.get(key, 'hamiltonian.npz')
+    if path is not None:
+        try:
+            return scipy.sparse.load_npz(path).asformat(format)
+        except FileNotFoundError:
+            # Evicted by another job in the meantime
+            pass
+
+    matrix = lattice.hamiltonian(**parameters)
+    cache.put(key, 'hamiltonian.npz',
+              lambda path: scipy.sparse.save_npz(path, matrix))
+    return matrix.asformat(format)
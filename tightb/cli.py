@@ -17,11 +17,13 @@
 # along with tightb.  If not, see <https://www.gnu.org/licenses/>.
 
 import argparse
-from tightb.tightb import argument_scaffolding
+import json
+import sys
+from tightb.tightb import argument_scaffolding, batch_argument_scaffolding
 
 
-def scaffolding():
-    parser = argparse.ArgumentParser()
+def argument_parser(prog: str = None) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog=prog)
     parser.add_argument('--dx', type=int, required=True)
     parser.add_argument('--dy', type=int, required=True)
     parser.add_argument('--orbitals', type=int, default=1, choices=[1, 2])
@@ -33,7 +35,123 @@ def scaffolding():
                         default=[],
                         required=False)
     parser.add_argument('--lattice', choices=['graphene'], required=True)
-    args = parser.parse_args()
+    parser.add_argument('--output', default=None, required=False)
+    parser.add_argument('--format',
+                        choices=['fortran', 'numpy'],
+                        default='fortran')
+    parser.add_argument('--loops', default=False, action='store_true')
+    parser.add_argument('--intern', default=False, action='store_true')
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--cache', default=None, required=False)
+    parser.add_argument('--cache-size', type=float, default=None)
+    parser.add_argument('--profile',
+                        nargs='?',
+                        const='-',
+                        default=None,
+                        required=False)
+    return parser
+
+
+def parse_arguments(parser: argparse.ArgumentParser,
+                    argv: list) -> argparse.Namespace:
+    args = parser.parse_args(argv)
+
+    if args.format == 'numpy' and not args.output:
+        parser.error("--format numpy requires --output")
+    if args.format == 'numpy' and args.loops:
+        parser.error("--loops is only available with --format fortran")
+    if args.format == 'numpy' and args.jobs != 1:
+        parser.error("--jobs is only available with --format fortran")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.cache_size is not None and not args.cache:
+        parser.error("--cache-size requires --cache")
+    sites = args.dx * args.dy
+    if any(not 1 <= site <= sites for site in args.remove_sites):
+        parser.error(f"--remove-sites must be between 1 and {sites}")
+
+    return args
+
+
+def configuration_arguments(configuration: dict) -> list:
+    # Command line equivalent of a configuration of the batch file, e.g.
+    # {"dx": 2, "rashba_soc": true, "remove_sites": [1, 5]}
+    argv = []
+    for name, value in configuration.items():
+        option = '--' + name.replace('_', '-')
+        if value is True:
+            argv.append(option)
+        elif isinstance(value, list):
+            argv += [option] + [str(item) for item in value]
+        elif value is not False and value is not None:
+            argv += [option, str(value)]
+    return argv
+
+
+def batch_scaffolding(argv: list, geometry_tables: dict = None) -> None:
+    # tightb.py batch FILE: one configuration per line of FILE, as a JSON
+    # object with the command line options as keys, all generated in this
+    # process
+    parser = argparse.ArgumentParser(prog='tightb.py batch')
+    parser.add_argument('configurations', type=argparse.FileType('r'))
+    args = parser.parse_args(argv)
+
+    configurations = []
+    with args.configurations as stream:
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                configuration = json.loads(line)
+            except ValueError as error:
+                parser.error(f"line {number}: {error}")
+            if not isinstance(configuration, dict):
+                parser.error(f"line {number}: expected a JSON object")
+
+            line_parser = argument_parser(f"tightb.py batch, line {number}")
+            configuration = parse_arguments(
+                    line_parser, configuration_arguments(configuration))
+            if not configuration.output:
+                line_parser.error("--output is required in a batch")
+            configurations.append(configuration)
+
+    batch_argument_scaffolding(configurations, geometry_tables)
+
+
+def serve_scaffolding(argv: list) -> None:
+    # tightb.py serve: generates on behalf of tightb_client.py, see
+    # tightb/server.py
+    from tightb.server import serve
+
+    parser = argparse.ArgumentParser(prog='tightb.py serve')
+    parser.add_argument('--socket', default=None, required=False)
+    # In MiB. Neighbor tables take about 112 bytes per orbital, e.g.
+    # 0.9 GB for dx = dy = 2000 with two orbitals.
+    parser.add_argument('--table-cache-size', type=float, default=256.0)
+    args = parser.parse_args(argv)
+    if args.table_cache_size < 0:
+        parser.error("--table-cache-size must not be negative")
+
+    try:
+        serve(args.socket, int(args.table_cache_size * (1 << 20)))
+    except OSError as error:
+        parser.error(str(error))
+
+
+def scaffolding(argv: list = None, geometry_tables: dict = None):
+    # `geometry_tables` keeps neighbor tables by geometry across calls
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['batch']:
+        batch_scaffolding(argv[1:], geometry_tables)
+        return
+    if argv[:1] == ['serve']:
+        serve_scaffolding(argv[1:])
+        return
+
+    args = parse_arguments(argument_parser(), argv)
 
     if args.lattice == 'graphene':
-        argument_scaffolding(args)
+        if geometry_tables is None:
+            argument_scaffolding(args)
+        else:
+            batch_argument_scaffolding([args], geometry_tables)
@@ -0,0 +1,97 @@
+# tightb generate tight-binding hamiltoniann crystalline structures
+# Copyright (C) 2021  Matheus S. M. Sousa
+#
+# This file is part of tightb.
+#
+# tightb is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# tightb is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with tightb.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import socket
+import struct
+import sys
+import tempfile
+
+# Frames sent back by the server: a kind, the payload length and the payload
+frame_header = struct.Struct('>cI')
+stdout_frame, stderr_frame, exit_frame = b'o', b'e', b'x'
+
+
+def default_socket() -> str:
+    return os.environ.get(
+            'TIGHTB_SOCKET',
+            os.path.join(tempfile.gettempdir(), f"tightb-{os.getuid()}.sock"))
+
+
+def send_frame(connection: socket.socket, kind: bytes, payload: bytes) -> None:
+    connection.sendall(frame_header.pack(kind, len(payload)) + payload)
+
+
+def receive_exactly(stream, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise ConnectionError("tightb server closed the connection")
+    return data
+
+
+def request(argv: list,
+            path: str = None,
+            stdout=None,
+            stderr=None,
+            stdin=None) -> int:
+    # Runs `argv`, the arguments of tightb.py, on the server listening at
+    # `path`. Its output and errors are copied to the binary streams
+    # `stdout` and `stderr`, ours by default, as they arrive, and the exit
+    # status is returned. The server reads no standard input of its own:
+    # the text stream `stdin`, ours by default, is sent along for
+    # `batch -`.
+    stdout = stdout or sys.stdout.buffer
+    stderr = stderr or sys.stderr.buffer
+    message = dict(argv=argv, cwd=os.getcwd())
+    if argv[:1] == ['batch'] and '-' in argv[1:]:
+        message['stdin'] = (stdin or sys.stdin).read()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path or default_socket())
+        connection.sendall(json.dumps(message).encode() + b'\n')
+
+        stream = connection.makefile('rb')
+        while True:
+            kind, size = frame_header.unpack(
+                    receive_exactly(stream, frame_header.size))
+            payload = receive_exactly(stream, size)
+            if kind == stdout_frame:
+                stdout.write(payload)
+            elif kind == stderr_frame:
+                stderr.write(payload)
+            else:
+                stdout.flush()
+                return int(payload)
+
+
+def client() -> None:
+    # Stands in for tightb.py: forwards the arguments to a running server, or
+    # generates in this process when there is none
+    try:
+        status = request(sys.argv[1:])
+    except (FileNotFoundError, ConnectionRefusedError):
+        from tightb import cli
+        cli.scaffolding()
+        status = 0
+    except ConnectionError as error:
+        # The server went away in the middle of the request
+        print(f"{os.path.basename(sys.argv[0])}: error: {error}",
+              file=sys.stderr)
+        status = 1
+    sys.exit(status)
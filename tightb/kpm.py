@@ -0,0 +1,166 @@
+# tightb generate tight-binding hamiltoniann crystalline structures
+# Copyright (C) 2021  Matheus S. M. Sousa
+#
+# This file is part of tightb.
+#
+# tightb is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# tightb is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with tightb.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+import scipy.sparse
+from concurrent.futures import ProcessPoolExecutor
+from tightb.tightb import Graphene
+
+# Number of random vectors propagated together in one sparse product
+chunk_vectors = 4
+
+
+def kpm_hamiltonian(lattice: Graphene, **parameters) -> tuple:
+    # Hamiltonian restricted to the orbitals that were not removed, rescaled
+    # so that its spectrum lies inside (-1, 1). The removed site penalty
+    # would otherwise set the scale and squeeze the physical spectrum into a
+    # few Chebyshev moments. Returns the rescaled matrix, the 0-based kept
+    # orbitals and the energy scale. The expansion only makes sense for a
+    # Hermitian matrix, so lattices whose stencil does not tile are
+    # rejected before anything is built.
+    lattice.check_tiling()
+    kept = lattice.kept_orbitals()
+    matrix = lattice.hamiltonian(**parameters)
+    if kept.size < matrix.shape[0]:
+        matrix = matrix[kept][:, kept]
+
+    # Gershgorin bound, slightly widened so that the edges of the spectrum
+    # stay away from the singularities of the Chebyshev weight. The matrix
+    # is rescaled in place, it can be most of the memory in use.
+    scale = 1.01 * np.abs(matrix).sum(axis=1).max()
+    matrix.data /= scale
+    return matrix, kept, scale
+
+
+def chebyshev_moments(matrix: scipy.sparse.spmatrix, vectors: np.array,
+                      moments: int) -> np.array:
+    # mu_n = <v|T_n(H)|v> for every column v of `vectors`, shape
+    # (moments, columns). Only half of the recursion is run, the remaining
+    # moments follow from T_2n = 2 T_n T_n - T_0 and
+    # T_2n+1 = 2 T_n+1 T_n - T_1.
+    mu = np.zeros((moments + moments % 2, vectors.shape[1]))
+    previous, current = vectors, matrix @ vectors
+    mu[0] = np.sum(vectors.conj() * vectors, axis=0).real
+    mu[1] = np.sum(vectors.conj() * current, axis=0).real
+    for n in range(1, len(mu) // 2):
+        previous, current = current, 2.0 * (matrix @ current) - previous
+        mu[2 * n] = 2.0 * np.sum(previous.conj() * previous, axis=0).real
+        mu[2 * n] -= mu[0]
+        mu[2 * n + 1] = 2.0 * np.sum(current.conj() * previous, axis=0).real
+        mu[2 * n + 1] -= mu[1]
+    return mu[:moments]
+
+
+def jackson_kernel(moments: int) -> np.array:
+    n = np.arange(moments)
+    q = np.pi / (moments + 1)
+    return ((moments - n + 1) * np.cos(q * n) +
+            np.sin(q * n) / np.tan(q)) / (moments + 1)
+
+
+def chebyshev_energies(points: int, scale: float) -> np.array:
+    # Chebyshev nodes, in increasing order, at which the expansion is
+    # evaluated by default
+    return -scale * np.cos(np.pi * (np.arange(points) + 0.5) / points)
+
+
+def reconstruct(mu: np.array, energies: np.array, scale: float) -> np.array:
+    # Density from its moments, damped by the Jackson kernel. `mu` has shape
+    # (moments, ...) and the result (..., len(energies)).
+    coefficients = mu * jackson_kernel(len(mu)).reshape(
+            (-1, ) + (1, ) * (mu.ndim - 1))
+    coefficients[1:] *= 2.0
+    x = np.asarray(energies, dtype=float) / scale
+    return (np.polynomial.chebyshev.chebval(x, coefficients) /
+            (np.pi * np.sqrt(1.0 - x * x) * scale))
+
+
+kpm_worker_state = {}
+
+
+def init_kpm_worker(matrix: scipy.sparse.spmatrix, moments: int) -> None:
+    kpm_worker_state['matrix'] = matrix
+    kpm_worker_state['moments'] = moments
+
+
+def random_phase_worker(task: tuple) -> np.array:
+    # Sum of the moments over `count` random phase vectors drawn from `seed`
+    seed, count = task
+    matrix = kpm_worker_state['matrix']
+    rng = np.random.default_rng(seed)
+    vectors = np.exp(2j * np.pi * rng.random((matrix.shape[0], count)))
+    return chebyshev_moments(matrix, vectors,
+                             kpm_worker_state['moments']).sum(axis=1)
+
+
+def density_of_states(lattice: Graphene,
+                      moments: int = 256,
+                      random_vectors: int = 16,
+                      energies: np.array = None,
+                      jobs: int = 1,
+                      seed: int = None,
+                      **parameters) -> tuple:
+    # Density of states per orbital from a stochastic estimate of the traces
+    # tr T_n(H). Random vectors are split in chunks, each seeded on its own,
+    # so the result depends on `seed` but not on `jobs`. Returns the DOS and
+    # the energies at which it was evaluated.
+    matrix, kept, scale = kpm_hamiltonian(lattice, **parameters)
+    if energies is None:
+        energies = chebyshev_energies(2 * moments, scale)
+
+    counts = [
+            min(chunk_vectors, random_vectors - start)
+            for start in range(0, random_vectors, chunk_vectors)
+    ]
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    tasks = list(zip(seeds, counts))
+    if jobs == 1:
+        init_kpm_worker(matrix, moments)
+        mu = sum(map(random_phase_worker, tasks))
+    else:
+        with ProcessPoolExecutor(jobs,
+                                 initializer=init_kpm_worker,
+                                 initargs=(matrix, moments)) as pool:
+            mu = sum(pool.map(random_phase_worker, tasks))
+
+    mu = mu / (random_vectors * len(kept))
+    return reconstruct(mu, energies, scale), energies
+
+
+def local_density_of_states(lattice: Graphene,
+                            orbitals: list,
+                            moments: int = 256,
+                            energies: np.array = None,
+                            **parameters) -> tuple:
+    # Local density of states on the given 1-based orbitals, shape
+    # (len(orbitals), len(energies)). The moments are exact, the expansion
+    # starting from the unit vector of each orbital.
+    matrix, kept, scale = kpm_hamiltonian(lattice, **parameters)
+    if energies is None:
+        energies = chebyshev_energies(2 * moments, scale)
+
+    orbitals = np.asarray(orbitals, dtype=int) - 1
+    columns = np.searchsorted(kept, orbitals)
+    if np.any(columns >= len(kept)) or np.any(
+            kept[np.minimum(columns, len(kept) - 1)] != orbitals):
+        raise ValueError("Orbitals must be in the lattice and not removed")
+
+    vectors = np.zeros((len(kept), len(columns)), dtype=complex)
+    vectors[columns, np.arange(len(columns))] = 1.0
+    mu = chebyshev_moments(matrix, vectors, moments)
+    return reconstruct(mu, energies, scale), energies
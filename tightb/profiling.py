@@ -0,0 +1,150 @@
+# tightb generate tight-binding hamiltoniann crystalline structures
+# Copyright (C) 2021  Matheus S. M. Sousa
+#
+# This file is part of tightb.
+#
+# tightb is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# tightb is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with tightb.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+def phase_record() -> dict:
+    return dict(seconds=0.0, calls=0, elements=0, bytes=0, peak_bytes=0)
+
+
+class Profile:
+    # Wall time, matrix elements, bytes written and memory per phase. Phases
+    # nest, so the time of a phase includes the phases run inside it, and
+    # re-entering a phase adds to it. Counts go to every active phase. The
+    # memory of a phase is the peak of what was allocated while it ran, over
+    # what was allocated when it started, as seen by tracemalloc (numpy
+    # arrays included), the largest over its calls.
+    def __init__(self):
+        self.phases = {}
+        # Everything counted, once
+        self.totals = dict(elements=0, bytes=0)
+        # [record, allocated at entry, peak allocated] of every active phase
+        self._active = []
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def fold_peak(self) -> None:
+        # tracemalloc keeps a single peak, which is reset on entering and
+        # leaving phases; every active phase keeps the peak it has seen
+        _, peak = tracemalloc.get_traced_memory()
+        for frame in self._active:
+            frame[2] = max(frame[2], peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def phase(self, name: str):
+        record = self.phases.setdefault(name, phase_record())
+        self.fold_peak()
+        allocated, _ = tracemalloc.get_traced_memory()
+        frame = [record, allocated, allocated]
+        self._active.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.fold_peak()
+            self._active.pop()
+            record['seconds'] += time.perf_counter() - start
+            record['calls'] += 1
+            record['peak_bytes'] = max(record['peak_bytes'],
+                                       frame[2] - frame[1])
+
+    def count(self, elements: int = 0, bytes: int = 0) -> None:
+        self.totals['elements'] += elements
+        self.totals['bytes'] += bytes
+        for record, _, _ in self._active:
+            record['elements'] += elements
+            record['bytes'] += bytes
+
+    def merge(self, other: 'Profile') -> None:
+        # Adds the phases profiled by a worker process, seconds adding up
+        # across processes like calls and counts. What the worker counted
+        # also goes to the phases active here.
+        for name, phase in other.phases.items():
+            record = self.phases.setdefault(name, phase_record())
+            for key in ['seconds', 'calls', 'elements', 'bytes']:
+                record[key] += phase[key]
+            record['peak_bytes'] = max(record['peak_bytes'],
+                                       phase['peak_bytes'])
+        for record, _, _ in self._active:
+            record['elements'] += other.totals['elements']
+            record['bytes'] += other.totals['bytes']
+        self.totals['elements'] += other.totals['elements']
+        self.totals['bytes'] += other.totals['bytes']
+
+    def stream(self, stream):
+        return ProfiledStream(self, stream)
+
+    def report(self) -> list:
+        return [dict(phase=name, **record)
+                for name, record in self.phases.items()]
+
+    def write(self, path: str = '-') -> None:
+        # A table on stderr for '-', JSON otherwise
+        if path != '-':
+            with open(path, 'w') as stream:
+                json.dump(self.report(), stream, indent=2)
+            return
+
+        print(f"{'phase':<40}{'seconds':>10}{'calls':>8}{'elements':>12}"
+              f"{'bytes':>14}{'phase peak MB':>15}",
+              file=sys.stderr)
+        for record in self.report():
+            print(f"{record['phase']:<40}{record['seconds']:>10.3f}"
+                  f"{record['calls']:>8}{record['elements']:>12}"
+                  f"{record['bytes']:>14}"
+                  f"{record['peak_bytes'] / (1 << 20):>15.1f}",
+                  file=sys.stderr)
+
+
+class NullProfile:
+    # Stands in for Profile when profiling is off
+    @contextmanager
+    def phase(self, name: str):
+        yield
+
+    def count(self, elements: int = 0, bytes: int = 0) -> None:
+        pass
+
+    def merge(self, other) -> None:
+        pass
+
+    def stream(self, stream):
+        return stream
+
+
+class ProfiledStream:
+    # Output stream whose writes are timed and counted as the "output" phase
+    def __init__(self, profile: Profile, stream):
+        self.profile = profile
+        self.stream = stream
+
+    def write(self, text: str) -> int:
+        with self.profile.phase("output"):
+            written = self.stream.write(text)
+            self.profile.count(bytes=len(text))
+        return written
+
+    def flush(self) -> None:
+        with self.profile.phase("output"):
+            self.stream.flush()
@@ -0,0 +1,154 @@
+# tightb generate tight-binding hamiltoniann crystalline structures
+# Copyright (C) 2021  Matheus S. M. Sousa
+#
+# This file is part of tightb.
+#
+# tightb is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# tightb is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with tightb.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import traceback
+from collections import OrderedDict
+from contextlib import redirect_stderr, redirect_stdout
+from tightb import cli
+from tightb.client import (default_socket, exit_frame, send_frame,
+                           stderr_frame, stdout_frame)
+
+
+class FrameStream(io.TextIOBase):
+    # Text stream sending everything written to it to the client
+    def __init__(self, connection: socket.socket, kind: bytes):
+        self.connection = connection
+        self.kind = kind
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if text:
+            send_frame(self.connection, self.kind, text.encode())
+        return len(text)
+
+
+def table_bytes(tables: dict) -> int:
+    # Memory held by the arrays of the neighbor tables of one geometry
+    return sum(
+            getattr(field, 'nbytes', 0) for table in tables.values()
+            for field in table)
+
+
+class GeometryTables(OrderedDict):
+    # Neighbor tables of the most recently used geometries. A geometry's
+    # tables fill up while it is generated, about 112 bytes per orbital, so
+    # the `max_bytes` bound is enforced by trim() after every request.
+    def __init__(self, max_bytes: int):
+        super().__init__()
+        self.max_bytes = max_bytes
+
+    def nbytes(self) -> int:
+        return sum(table_bytes(tables) for tables in self.values())
+
+    def setdefault(self, geometry: tuple, tables: dict = None) -> dict:
+        if geometry in self:
+            self.move_to_end(geometry)
+            return self[geometry]
+
+        self[geometry] = tables
+        self.trim()
+        return tables
+
+    def trim(self) -> None:
+        # Drops the least recently used geometries, down to the most recent
+        # one if it alone is over the bound
+        while self and self.nbytes() > self.max_bytes:
+            self.popitem(last=False)
+
+
+class GeneratorHandler(socketserver.StreamRequestHandler):
+    # A request is a JSON line with the arguments of tightb.py, the working
+    # directory of the client and, for `batch -`, its standard input.
+    # Requests are served one at a time, so redirecting the standard streams
+    # and changing directory is safe. The server's own standard input is
+    # never read, a request without one gets an empty stream.
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # Probe from a server checking whether this one is alive
+            return
+        request = json.loads(line)
+        stdout = FrameStream(self.connection, stdout_frame)
+        stderr = FrameStream(self.connection, stderr_frame)
+
+        status = 0
+        stdin, sys.stdin = sys.stdin, io.StringIO(request.get('stdin', ''))
+        try:
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                if request['argv'][:1] == ['serve']:
+                    raise SystemExit("tightb.py serve: already serving")
+                os.chdir(request['cwd'])
+                cli.scaffolding(request['argv'],
+                                self.server.geometry_tables)
+        except ConnectionError:
+            # The client went away
+            return
+        except SystemExit as exit:
+            if isinstance(exit.code, int):
+                status = exit.code
+            elif exit.code is not None:
+                stderr.write(f"{exit.code}\n")
+                status = 1
+        except Exception:
+            stderr.write(traceback.format_exc())
+            status = 1
+        finally:
+            sys.stdin = stdin
+            self.server.geometry_tables.trim()
+
+        send_frame(self.connection, exit_frame, str(status).encode())
+
+
+class GeneratorServer(socketserver.UnixStreamServer):
+    def __init__(self, path: str, max_bytes: int):
+        self.geometry_tables = GeometryTables(max_bytes)
+        super().__init__(path, GeneratorHandler)
+        os.chmod(path, 0o600)
+
+
+def serve(path: str = None, max_bytes: int = 256 << 20) -> None:
+    # Serves generation requests on the Unix socket `path` until
+    # interrupted, keeping up to `max_bytes` of neighbor tables of recent
+    # geometries warm
+    path = path or default_socket()
+    if os.path.exists(path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(path)
+            except ConnectionRefusedError:
+                # Left behind by a server that did not shut down cleanly
+                os.unlink(path)
+            else:
+                raise OSError(f"A tightb server is already listening on "
+                              f"{path}")
+
+    with GeneratorServer(path, max_bytes) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(path)
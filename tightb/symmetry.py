@@ -26,40 +26,60 @@ unitcell_sequence = np.array(
 
 eps = 1e-15
 
+# Two points are the same site when both coordinates agree within this
+match_tolerance = 1e-8
+
 
 def graphene_lattice_real_coordinates(nx: int,
                                       ny: int,
-                                      removed_sites: list = []) -> list:
-    coordinates = []
+                                      removed_sites: list = []) -> np.array:
+    # Site 4 * nx * j + 4 * i + k sits at offset k of cell i in row j, the
+    # offsets following unitcell_sequence from the first site of the cell.
+    # Returns an (N, 2) array sorted by x and then y.
+    offsets = np.concatenate([[[0.0, 0.0]], np.cumsum(unitcell_sequence,
+                                                      axis=0)])
+    cell_step = -graphene_delta[2] + offsets[-1]
+    row_step = np.array([0.0, np.sqrt(3.0)])
 
-    def append_valid(indice, element):
-        if (indice not in removed_sites):
-            coordinates.append(element)
+    j, i, k = np.meshgrid(np.arange(ny),
+                          np.arange(nx),
+                          np.arange(4),
+                          indexing='ij')
+    coordinates = (j[..., np.newaxis] * row_step +
+                   i[..., np.newaxis] * cell_step + offsets[k]).reshape(-1, 2)
 
-    for j in range(ny):
-        x0 = np.array([0.0, j * np.sqrt(3.0)])
-        append_valid(4 * nx * j, np.array(x0 + [0., 0.]))
-        for i in range(nx):
-            indice = 4 * i + 4 * nx * j
-            for idx in range(3):
-                append_valid(indice + idx + 1, x0 + unitcell_sequence[idx])
-                x0 += unitcell_sequence[idx]
+    keep = np.ones(len(coordinates), dtype=bool)
+    removed_sites = np.asarray(removed_sites, dtype=int)
+    keep[removed_sites[(removed_sites >= 0)
+                       & (removed_sites < len(coordinates))]] = False
 
-            if i < nx - 1:
-                append_valid(indice + 4, x0 - graphene_delta[2])
+    coordinates = np.round(coordinates[keep], 9)
+    return coordinates[np.lexsort((coordinates[:, 1], coordinates[:, 0]))]
 
-            x0 -= graphene_delta[2]
 
-    return sorted(np.round(coordinates, 9), key=lambda x: (x[0], x[1]))
+def as_points(lattice: list) -> np.array:
+    return np.asarray(lattice, dtype=float).reshape(-1, 2)
 
 
 # Lets handle only the cases parallel to x or y axis
+def reflect_points_by_vertical_axis(points: np.array,
+                                    x_star: float) -> np.array:
+    points = as_points(points)
+    return np.stack([x_star - points[:, 0], points[:, 1]], axis=-1)
+
+
+def reflect_points_by_horizontal_axis(points: np.array,
+                                      y_star: float) -> np.array:
+    points = as_points(points)
+    return np.stack([points[:, 0], y_star - points[:, 1]], axis=-1)
+
+
 def reflect_point_by_vertical_axis(x0: np.array, x_star: float) -> np.array:
-    return np.array([x_star - x0[0], x0[1]])
+    return reflect_points_by_vertical_axis(x0, x_star)[0]
 
 
 def reflect_point_by_horizontal_axis(x0: np.array, y_star: float) -> np.array:
-    return np.array([x0[0], y_star - x0[1]])
+    return reflect_points_by_horizontal_axis(x0, y_star)[0]
 
 
 class Boundary:
@@ -77,45 +97,38 @@ class Boundary:
         return f"xmin = {self.xmin}, xmax = {self.xmax}, ymin = {self.ymin}," \
                 f"ymax =  {self.ymax}"
 
-    def apply_boundary(self, x0: np.array) -> np.array:
-        x, y = x0
-        if x >= self.xmax:
-            x -= (self.xmax - self.xmin)
-        elif x < self.xmin:
-            x += (self.xmax - self.xmin)
+    def wrap(self, points: np.array) -> np.array:
+        # Brings points that left the box by less than a period back in,
+        # for a whole (N, 2) array at once
+        points = as_points(points)
+        x, y = points[:, 0], points[:, 1]
+        width = self.xmax - self.xmin
+        height = self.ymax - self.ymin
 
-        if y >= self.ymax:
-            y -= (self.ymax - self.ymin)
-        elif y < self.ymin:
-            y += (self.ymax - self.ymin)
+        x = np.where(x >= self.xmax, x - width,
+                     np.where(x < self.xmin, x + width, x))
+        y = np.where(y >= self.ymax, y - height,
+                     np.where(y < self.ymin, y + height, y))
+        return np.stack([x, y], axis=-1)
 
-        return np.array([x, y])
+    def apply_boundary(self, x0: np.array) -> np.array:
+        return self.wrap(x0)[0]
 
 
 def boundary_from_lattice(lattice: list,
                           offset_x: float = 0.0,
                           offset_y: float = 0.0) -> Boundary:
-    xmin = 0.0
-    xmax = 0.0
-    ymin = 0.0
-    ymax = 0.0
-
-    for coordinate in lattice:
-        x, y = coordinate
-
-        xmin = min(xmin, x)
-        xmax = max(xmax, x)
-
-        ymin = min(ymin, y)
-        ymax = max(ymax, y)
+    points = np.concatenate([[[0.0, 0.0]], as_points(lattice)])
+    xmin, ymin = points.min(axis=0)
+    xmax, ymax = points.max(axis=0)
 
     return Boundary(xmin - (offset_x + eps), xmax + (offset_x + eps),
                     ymin - (offset_y + eps), ymax + (offset_y + eps))
 
 
 # Now the more complicated cases where the axis is tilted by some angle alpha
-def reflect_point_by_tilted_axis(
-        x0: np.array,
+def reflect_points_by_tilted_axis(
+        points: np.array,
         v: np.array,
         r_star: list = [0.0, 0.0],
         boundary: Boundary = Boundary()) -> np.array:
@@ -125,134 +138,242 @@ def reflect_point_by_tilted_axis(
     # y = x0 + v_y * t
     #
     # v is the unit vector in the direction of the tilted axis
+    v = np.asarray(v, dtype=float)
     v = v / np.sqrt(v @ v)
 
-    # alpha is the angle between the tilted axis and the y axis
+    # alpha is the angle between the tilted axis and the y axis, computed
+    # once for all the points
     yhat = np.array([0.0, 1.0])
     alpha = np.arccos(yhat @ v)
+    cos, sin = np.cos(alpha), np.sin(alpha)
 
-    x0_rot = np.array([(x0[0] - r_star[0]) * np.cos(alpha) -
-                       (x0[1] - r_star[1]) * np.sin(alpha),
-                       (x0[0] - r_star[0]) * np.sin(alpha) +
-                       (x0[1] - r_star[1]) * np.cos(alpha)])
+    points = as_points(points)
+    dx = points[:, 0] - r_star[0]
+    dy = points[:, 1] - r_star[1]
+    x_rot = dx * cos - dy * sin
+    y_rot = dx * sin + dy * cos
 
     # Reflect
-    x0_ref = np.array([-x0_rot[0], x0_rot[1]])
+    x_ref, y_ref = -x_rot, y_rot
 
     # Then rotate and translate back
-    return boundary.apply_boundary(
-            np.array([
-                    r_star[0] + x0_ref[0] * np.cos(alpha) +
-                    x0_ref[1] * np.sin(alpha), r_star[1] -
-                    x0_ref[0] * np.sin(alpha) + x0_ref[1] * np.cos(alpha)
-            ]))
+    return boundary.wrap(
+            np.stack([
+                    r_star[0] + x_ref * cos + y_ref * sin,
+                    r_star[1] - x_ref * sin + y_ref * cos
+            ],
+                     axis=-1))
+
+
+def reflect_point_by_tilted_axis(
+        x0: np.array,
+        v: np.array,
+        r_star: list = [0.0, 0.0],
+        boundary: Boundary = Boundary()) -> np.array:
+    return reflect_points_by_tilted_axis(x0, v, r_star, boundary)[0]
 
 
-def reflect_lattice_by_vertical_axis(lattice: list, x_star) -> list:
-    reflected_lattice = []
-    for site in lattice:
-        reflected_lattice.append(reflect_point_by_vertical_axis(site, x_star))
-    return reflected_lattice
+def reflect_lattice_by_vertical_axis(lattice: list, x_star) -> np.array:
+    return reflect_points_by_vertical_axis(lattice, x_star)
 
 
-def reflect_lattice_by_horizontal_axis(lattice: list, y_star) -> list:
-    reflected_lattice = []
-    for site in lattice:
-        reflected_lattice.append(reflect_point_by_horizontal_axis(
-                site, y_star))
-    return reflected_lattice
+def reflect_lattice_by_horizontal_axis(lattice: list, y_star) -> np.array:
+    return reflect_points_by_horizontal_axis(lattice, y_star)
 
 
 def reflect_lattice_by_axis(
         lattice: list,
         v: np.array,
         r_star: list,
-        boundary: Boundary = Boundary()) -> list:
-    reflected_lattice = []
-    for site in lattice:
-        reflected_lattice.append(
-                reflect_point_by_tilted_axis(site, v, r_star, boundary))
-    return reflected_lattice
+        boundary: Boundary = Boundary()) -> np.array:
+    return reflect_points_by_tilted_axis(lattice, v, r_star, boundary)
+
+
+class LatticeIndex:
+    # Points of a lattice sorted by integer cell keys, cells being squares of
+    # side 2 * tolerance. A point within tolerance of a lattice point lies in
+    # one of at most four cells around it, so membership is a handful of
+    # vectorized binary searches instead of sorting the transformed lattice.
+    # Assumes lattice points are much further apart than the tolerance.
+    def __init__(self, lattice: list, tolerance: float = match_tolerance):
+        self.tolerance = tolerance
+        points = np.asarray(lattice, dtype=float).reshape(-1, 2)
+        keys = self.cell_keys(points)
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.points = points[order]
+
+    def cell_keys(self, points: np.array, shift: np.array = 0.0) -> np.array:
+        # Complex numbers sort by real and then imaginary part, so the cell
+        # (i, j) is keyed as i + 1j * j
+        cells = np.floor((points + shift) / (2.0 * self.tolerance))
+        return cells[:, 0] + 1j * cells[:, 1]
+
+    def contains(self, points: np.array) -> np.array:
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        found = np.zeros(len(points), dtype=bool)
+        if len(self.keys) == 0:
+            return found
+
+        for shift in [[-1, -1], [-1, 1], [1, -1], [1, 1]]:
+            keys = self.cell_keys(points, self.tolerance * np.array(shift))
+            index = np.minimum(np.searchsorted(self.keys, keys),
+                               len(self.keys) - 1)
+            found |= (self.keys[index] == keys) & np.all(
+                    np.abs(self.points[index] - points) <= self.tolerance,
+                    axis=1)
+        return found
+
+    def matches(self, points: np.array) -> bool:
+        # Whether `points`, the image of the lattice under an isometry, is the
+        # lattice itself
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        return len(points) == len(self.points) and bool(
+                np.all(self.contains(points)))
 
 
 def is_symmetric_by_reflection(
         lattice: list,
         v: np.array,
         r_star: list,
-        boundary: Boundary = Boundary()) -> bool:
-    reflected_lattice = sorted(np.round(
-            reflect_lattice_by_axis(lattice, v, r_star, boundary), 9),
-                               key=lambda x: (x[0], x[1]))    # HACK(keyehz)
-    return np.allclose(lattice, reflected_lattice)
+        boundary: Boundary = Boundary(),
+        index: LatticeIndex = None) -> bool:
+    index = LatticeIndex(lattice) if index is None else index
+    return index.matches(reflect_lattice_by_axis(lattice, v, r_star,
+                                                 boundary))
+
+
+def coordinate_profile(coordinates: np.array,
+                       tolerance: float = match_tolerance) -> np.array:
+    # Distinct values of a coordinate, up to tolerance, next to how many
+    # sites share each of them, as an (N, 2) array
+    coordinates = np.sort(np.asarray(coordinates, dtype=float))
+    starts = np.flatnonzero(
+            np.diff(coordinates, prepend=-np.inf) > tolerance)
+    counts = np.diff(np.append(starts, len(coordinates)))
+    return np.stack([coordinates[starts], counts], axis=-1)
+
+
+def periodic_candidates(values: np.array,
+                        lower: float,
+                        upper: float,
+                        period: float,
+                        tolerance: float = match_tolerance) -> np.array:
+    # The values shifted by whole periods that land in [lower, upper],
+    # sorted and with those within tolerance of each other merged. A period
+    # below tolerance is a box flat along that direction, with nothing to
+    # shift.
+    values = np.asarray(values, dtype=float)
+    if period > tolerance and len(values):
+        first = np.ceil((lower - tolerance - values) / period)
+        last = np.floor((upper + tolerance - values) / period)
+        steps = np.arange(first.min(), last.max() + 1)
+        values = (values[:, None] + steps * period).ravel()
+    values = np.sort(values[(values >= lower - tolerance)
+                            & (values <= upper + tolerance)])
+
+    keep = np.ones(len(values), dtype=bool)
+    keep[1:] = np.diff(values) > tolerance
+    return values[keep]
+
+
+def reflection_axis_candidates(coordinates: np.array,
+                               lower: float,
+                               upper: float,
+                               tolerance: float = match_tolerance) -> np.array:
+    # Positions in [lower, upper] of the axes that could mirror the given
+    # coordinates onto themselves. A mirror at a sends the first coordinate
+    # c0 onto some cj, so 2 a = c0 + cj modulo the period upper - lower, and
+    # a is a bisector (a site itself when j = 0) up to half periods.
+    profile = coordinate_profile(coordinates, tolerance)
+    coordinates = profile[:, 0]
+    if len(coordinates) == 0:
+        return coordinates
+
+    candidates = periodic_candidates(0.5 * (coordinates[0] + coordinates),
+                                     lower, upper, 0.5 * (upper - lower),
+                                     tolerance)
+
+    # A mirror of the sites also mirrors how many of them share each
+    # coordinate, which is cheap to check before the whole lattice
+    index = LatticeIndex(profile, tolerance)
+    period = Boundary(xmin=lower, xmax=upper)
+    return np.array([
+            a for a in candidates if index.matches(
+                    period.wrap(reflect_points_by_vertical_axis(
+                            profile, 2.0 * a)))
+    ])
 
 
 def vertical_reflection_axis(lattice: list, boundary: Boundary) -> list:
-    # TODO(keyezh): hardcoded, not sure if good enough but seems to pass all
-    # the test so far
-    N = 800
-    dx = (boundary.xmax - boundary.xmin) / float(N)
-
     reflection_axes = []
     axis_direction = np.array([0.0, 1.0])    # parallel to y axis
+    index = LatticeIndex(lattice)
 
-    for j in range(N + 1):
-        r = np.array([boundary.xmin + j * dx, 0.0])
+    for x_star in reflection_axis_candidates(
+            as_points(lattice)[:, 0], boundary.xmin, boundary.xmax):
+        r = np.array([x_star, 0.0])
 
-        if is_symmetric_by_reflection(lattice, axis_direction, r, boundary):
+        if is_symmetric_by_reflection(lattice, axis_direction, r, boundary,
+                                      index):
             reflection_axes.append(r)
 
     return reflection_axes
 
 
 def horizontal_reflection_axis(lattice: list, boundary: Boundary) -> list:
-    # TODO(keyezh): hardcoded, not sure if good enough but seems to pass all
-    # the test so far
-    N = 800
-    dy = (boundary.ymax - boundary.ymin) / float(N)
-
     reflection_axes = []
     axis_direction = np.array([1.0, 0.0])    # parallel to x axis
+    index = LatticeIndex(lattice)
 
-    for j in range(N + 1):
-        r = np.array([0.0, boundary.ymin + j * dy])
+    for y_star in reflection_axis_candidates(
+            as_points(lattice)[:, 1], boundary.ymin, boundary.ymax):
+        r = np.array([0.0, y_star])
 
-        if is_symmetric_by_reflection(lattice, axis_direction, r, boundary):
+        if is_symmetric_by_reflection(lattice, axis_direction, r, boundary,
+                                      index):
             reflection_axes.append(r)
 
     return reflection_axes
 
 
+def translate_points_in_direction_by_amount(
+        points: np.array,
+        v: np.array,
+        shift_amount: float,
+        boundary: Boundary = Boundary()) -> np.array:
+    return boundary.wrap(
+            as_points(points) + shift_amount * np.asarray(v, dtype=float))
+
+
 def translate_point_in_direction_by_amount(
         x0: np.array,
         v: np.array,
         shift_amount: float,
         boundary: Boundary = Boundary()) -> np.array:
-    return boundary.apply_boundary(x0 + shift_amount * v)
+    return translate_points_in_direction_by_amount(x0, v, shift_amount,
+                                                   boundary)[0]
 
 
 def translate_lattice_in_direction_by_amount(
         lattice: list,
         v: np.array,
         shift_amount: float,
-        boundary: Boundary = Boundary()) -> list:
-    translated_lattice = []
-    for site in lattice:
-        translated_lattice.append(
-                translate_point_in_direction_by_amount(site, v, shift_amount,
-                                                       boundary))
-    return translated_lattice
+        boundary: Boundary = Boundary()) -> np.array:
+    return translate_points_in_direction_by_amount(lattice, v, shift_amount,
+                                                   boundary)
 
 
 def is_symmetric_by_translation(
         lattice: list,
         v: np.array,
         shift_amount: float,
-        boundary: Boundary = Boundary()) -> bool:
-    translated_lattice = sorted(np.round(
+        boundary: Boundary = Boundary(),
+        index: LatticeIndex = None) -> bool:
+    index = LatticeIndex(lattice) if index is None else index
+    return index.matches(
             translate_lattice_in_direction_by_amount(lattice, v, shift_amount,
-                                                     boundary), 9),
-                                key=lambda x: (x[0], x[1]))    # HACK(keyehz)
-    return np.allclose(lattice, translated_lattice)
+                                                     boundary))
 
 
 def perform_glide_operation_on_point_by_axis_by_amount(
@@ -279,53 +400,84 @@ def is_symmetric_by_glide(
         v: np.array,
         r_star: list,
         shift_amount: float,
-        boundary: Boundary = Boundary()) -> bool:
+        boundary: Boundary = Boundary(),
+        index: LatticeIndex = None) -> bool:
+    index = LatticeIndex(lattice) if index is None else index
     reflected_lattice = reflect_lattice_by_axis(lattice, v, r_star, boundary)
-    glide_lattice = sorted(np.round(
+    return index.matches(
             translate_lattice_in_direction_by_amount(reflected_lattice, v,
-                                                     shift_amount, boundary),
-            9),
-                           key=lambda x: (x[0], x[1]))    # HACK(keyehz)
-    return np.allclose(lattice, glide_lattice)
+                                                     shift_amount, boundary))
+
+
+def glide_candidates(lattice: list,
+                     boundary: Boundary,
+                     tolerance: float = match_tolerance) -> list:
+    # Pairs (a, s) of an axis x = a and a shift s along y that could make a
+    # glide of the lattice. The axis mirrors the x coordinates, so it comes
+    # from reflection_axis_candidates. The shift takes the mirror image of a
+    # site p onto some site q of the column it lands in, s = q_y - p_y up to
+    # periods, and p is taken in the least populated column to have the
+    # fewest differences to try.
+    points = as_points(lattice)
+    if len(points) == 0:
+        return []
+
+    x_profile = coordinate_profile(points[:, 0], tolerance)
+    column = x_profile[np.argmin(x_profile[:, 1]), 0]
+    p = points[np.argmin(np.abs(points[:, 0] - column))]
+
+    # The translation part has to preserve how many sites share each y
+    y_profile = coordinate_profile(points[:, 1], tolerance)
+    y_index = LatticeIndex(y_profile, tolerance)
+    y_period = Boundary(xmin=boundary.ymin, xmax=boundary.ymax)
+
+    candidates = []
+    for a in reflection_axis_candidates(points[:, 0], boundary.xmin,
+                                        boundary.xmax, tolerance):
+        image = reflect_points_by_tilted_axis(p, [0.0, 1.0], [a, 0.0],
+                                              boundary)[0]
+        q = points[np.abs(points[:, 0] - image[0]) <= tolerance]
+        for shift in periodic_candidates(q[:, 1] - p[1], boundary.ymin,
+                                         boundary.ymax,
+                                         boundary.ymax - boundary.ymin,
+                                         tolerance):
+            if y_index.matches(
+                    y_period.wrap(y_profile + np.array([shift, 0.0]))):
+                candidates.append((a, shift))
+    return candidates
+
+
+def transpose_boundary(boundary: Boundary) -> Boundary:
+    return Boundary(xmin=boundary.ymin,
+                    xmax=boundary.ymax,
+                    ymin=boundary.xmin,
+                    ymax=boundary.xmax)
 
 
 def vertical_glide_axis(lattice: list, boundary: Boundary) -> list:
-    # TODO(keyezh): hardcoded, not sure if good enough but seems to pass all
-    # the test so far
-    N = 100
-    dx = (boundary.xmax - boundary.xmin) / float(N)
-    dy = (boundary.ymax - boundary.ymin) / float(N)
-
     glide_axes = []
     axis_direction = np.array([0.0, 1.0])    # parallel to y axis
-    sorted_lattice = sorted(np.round(lattice, 9), key=lambda x: (x[0], x[1]))
-
-    for j in range(N + 1):
-        r = np.array([boundary.xmin + j * dx, 0.0])
-        for k in range(N + 1):
-            shift_amount = boundary.ymin + k * dy
-            if is_symmetric_by_glide(sorted_lattice, axis_direction, r,
-                                     shift_amount, boundary):
-                glide_axes.append(r)
+    index = LatticeIndex(lattice)
+
+    # The axis is appended once for every shift that makes a glide
+    for x_star, shift_amount in glide_candidates(lattice, boundary):
+        r = np.array([x_star, 0.0])
+        if is_symmetric_by_glide(lattice, axis_direction, r, shift_amount,
+                                 boundary, index):
+            glide_axes.append(r)
     return glide_axes
 
 
 def horizontal_glide_axis(lattice: list, boundary: Boundary) -> list:
-    # TODO(keyezh): hardcoded, not sure if good enough but seems to pass all
-    # the test so far
-    N = 100
-    dy = (boundary.ymax - boundary.ymin) / float(N)
-    dx = (boundary.xmax - boundary.xmin) / float(N)
-
     glide_axes = []
     axis_direction = np.array([1.0, 0.0])    # parallel to x axis
-    sorted_lattice = sorted(np.round(lattice, 9), key=lambda x: (x[0], x[1]))
-
-    for j in range(N + 1):
-        r = np.array([0.0, boundary.ymin + j * dy])
-        for k in range(N + 1):
-            shift_amount = boundary.xmin + k * dx
-            if is_symmetric_by_glide(sorted_lattice, axis_direction, r,
-                                     shift_amount, boundary):
-                glide_axes.append(r)
+    index = LatticeIndex(lattice)
+
+    # Same search with the roles of x and y swapped
+    for y_star, shift_amount in glide_candidates(
+            as_points(lattice)[:, ::-1], transpose_boundary(boundary)):
+        r = np.array([0.0, y_star])
+        if is_symmetric_by_glide(lattice, axis_direction, r, shift_amount,
+                                 boundary, index):
+            glide_axes.append(r)
     return glide_axes
@@ -16,8 +16,40 @@
 # You should have received a copy of the GNU General Public License
 # along with tightb.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
+import shutil
+import sys
 import numpy as np
-from tightb.writers import FortranWriter
+import scipy.sparse
+import scipy.sparse.linalg
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from tightb.cache import Cache
+from tightb.profiling import NullProfile, Profile
+from tightb.writers import ExpressionTable, FortranWriter, NumpyWriter
+
+# Diagonal energy used to push the orbitals of removed sites out of the
+# spectrum
+removed_site_penalty = 1000000.0
+
+# Number of orbitals handled at once when walking the lattice
+chunk_orbitals = 1 << 16
+
+# Every orbital of the lattice together with its neighbors. `source` is the
+# (0-based) orbital index, `target` and `direction` hold one column per bond
+# and `site_kind` selects the sublattice (0 -> A, 1 -> B, 2 -> C, 3 -> D).
+# `winding` counts, per bond, how many times it wraps around the periodic
+# lattice along the rows and along the columns.
+NeighborTable = namedtuple(
+        'NeighborTable',
+        ['source', 'target', 'direction', 'site_kind', 'winding'])
+
+# Matrix elements of a single term, one row per source orbital. `row` and
+# `col` are 1-based (Fortran) indices, `result` the ids of the expressions
+# in Graphene.expressions and `winding` the wrapping of each element.
+MatrixElements = namedtuple(
+        'MatrixElements',
+        ['name', 'source', 'direction', 'row', 'col', 'result', 'winding'])
 
 
 class SquareSites:
@@ -191,89 +223,217 @@ class Graphene:
                  orbitals=1,
                  rashba_soc=False,
                  external_mag=False,
-                 sites_removed=[]):
+                 sites_removed=[],
+                 tables=None,
+                 profile=NullProfile()):
         self.dx = dx
         self.dy = dy
         self.writer = writer
         self.orbitals = orbitals
         self.rashba_soc = rashba_soc
         self.external_mag = external_mag
-        self.sites_removed = self.convert_to_orbital(sites_removed)
+        self.removed = self.removed_mask(
+                self.convert_to_orbital(sites_removed))
         self.Site = GrapheneSites()
+        # Neighbor tables by rows, shared between lattices of the same
+        # geometry when a dict is given
+        self.tables = tables
+        self.profile = profile
+        self.expressions = ExpressionTable(
+                ["0.0", removed_site_penalty, "t"] + [
+                        expression for Site in self.sites
+                        for spin in [True, False]
+                        for expression in Site.rashba(spin)
+                ] + [external_mag_mat(i, j) for i in range(2)
+                     for j in range(2)])
+
+    @property
+    def sites_removed(self) -> list:
+        return np.flatnonzero(self.removed).tolist()
+
+    def configuration(self) -> dict:
+        # Everything that determines the generated Hamiltonian
+        return dict(lattice='graphene',
+                    dx=self.dx,
+                    dy=self.dy,
+                    orbitals=self.orbitals,
+                    rashba_soc=self.rashba_soc,
+                    external_mag=self.external_mag,
+                    sites_removed=self.sites_removed)
+
+    def kept_orbitals(self) -> np.array:
+        # 0-based orbitals of the sites that were not removed
+        size = self.dx * self.orbitals * self.dy
+        return np.flatnonzero(~self.removed[1:size + 1])
 
     def periodic(self, start_position: np.array, delta: np.array) -> np.array:
-        return np.array([(start_position[0] + delta[0]) % self.dx,
-                         (start_position[1] + self.orbitals * delta[1]) %
-                         (self.orbitals * self.dy)])
+        return np.stack([(start_position[..., 0] + delta[..., 0]) % self.dx,
+                         (start_position[..., 1] +
+                          self.orbitals * delta[..., 1]) %
+                         (self.orbitals * self.dy)],
+                        axis=-1)
 
     def convert_coordinates(self, coordinate_in_grid: np.array) -> int:
         return coordinate_in_grid[
-                0] * self.dy * self.orbitals + coordinate_in_grid[1]
+                ..., 0] * self.dy * self.orbitals + coordinate_in_grid[..., 1]
 
     def is_removed(self, pair_coords: list) -> bool:
-        return any(coord in self.sites_removed for coord in pair_coords)
+        return any(self.removed[coord] for coord in pair_coords)
 
     def check_removed(self, pair_coords: list, result: str) -> str:
         return "0.0" if self.is_removed(pair_coords) else result
 
-    def print_matrix_component_spinless(self, x0, x0_coordinate, Site) -> None:
-        for delta, direction in zip(Site.delta, Site.direction):
-            x = self.periodic(x0, delta)
-            x_coordinate = self.convert_coordinates(x)
-
-            pair_coords = [x0_coordinate + 1, x_coordinate + 1]
-            result = self.check_removed(pair_coords, "t")
-            self.writer.matrix_element("tij1",
-                                       direction,
-                                       *pair_coords,
-                                       result=result)
-
-    def print_matrix_component_rashba(self, x0, x0_coordinate, Site) -> None:
-        spin = x0_coordinate % 2 == 0
-
-        for delta, direction, rashba in zip(Site.delta, Site.direction,
-                                            Site.rashba(spin)):
-            x = self.periodic(x0, delta)
-            x_coordinate = self.convert_coordinates(x)
-
-            pair_coords = []
-
-            if spin:
-                pair_coords = [x0_coordinate + 1, x_coordinate + 2]
-            else:
-                pair_coords = [x0_coordinate + 1, x_coordinate]
-
-            result = self.check_removed(pair_coords, rashba)
-            self.writer.matrix_element("tij2",
-                                       direction,
-                                       *pair_coords,
-                                       result=result)
-
-    def print_matrix_component_external_mag(self, x0, x0_coordinate,
-                                            Site) -> None:
-        spin = x0_coordinate % 2 == 0
-
-        result = ""
-        pair_coords = [x0_coordinate + 1, x0_coordinate + 1]
-
-        if spin:
-            result = self.check_removed(pair_coords, external_mag_mat(0, 0))
-        else:
-            result = self.check_removed(pair_coords, external_mag_mat(1, 1))
-
-        self.writer.matrix_element("tij3", 0, *pair_coords, result=result)
-
-        if spin:
-            pair_coords = [x0_coordinate + 1, x0_coordinate + 2]
-            result = self.check_removed(pair_coords, external_mag_mat(0, 1))
-        else:
-            pair_coords = [x0_coordinate + 1, x0_coordinate]
-            result = self.check_removed(pair_coords, external_mag_mat(1, 0))
-
-        self.writer.matrix_element("tij3", 0, *pair_coords, result=result)
+    def is_removed_elements(self, elements: MatrixElements) -> np.array:
+        return self.removed[elements.row] | self.removed[elements.col]
+
+    def check_removed_elements(self,
+                               elements: MatrixElements) -> MatrixElements:
+        return elements._replace(
+                result=np.where(self.is_removed_elements(elements),
+                                self.expressions.intern("0.0"),
+                                elements.result))
+
+    @property
+    def sites(self) -> list:
+        return [self.Site.A, self.Site.B, self.Site.C, self.Site.D]
+
+    def neighbor_table(self,
+                       rows: range = None,
+                       source: np.array = None) -> NeighborTable:
+        # Neighbors of every orbital in `rows` of the lattice, or of the
+        # 0-based orbitals `source` when given
+        if source is None:
+            rows = range(self.dx) if rows is None else rows
+            source = np.arange(rows.start * self.orbitals * self.dy,
+                               rows.stop * self.orbitals * self.dy)
+            if self.tables is None:
+                return self.neighbor_table(source=source)
+            if (rows.start, rows.stop) not in self.tables:
+                self.tables[rows.start,
+                            rows.stop] = self.neighbor_table(source=source)
+            return self.tables[rows.start, rows.stop]
+
+        delta = np.array([Site.delta for Site in self.sites])
+        direction = np.array([Site.direction for Site in self.sites])
+        site_kind = self.normalize_site(source) % 4
+
+        x0 = np.stack(np.divmod(source, self.orbitals * self.dy), axis=-1)
+        x = self.periodic(x0[:, np.newaxis, :], delta[site_kind])
+
+        shifted = x0[:, np.newaxis, :] + delta[site_kind] * [1, self.orbitals]
+        winding = shifted // [self.dx, self.orbitals * self.dy]
+
+        return NeighborTable(source, self.convert_coordinates(x),
+                             direction[site_kind], site_kind, winding)
+
+    def stencil_tiles(self) -> bool:
+        # Whether the four-site stencil repeats along a row
+        return (self.orbitals * self.dy) % (4 * self.orbitals) == 0
+
+    def check_tiling(self) -> None:
+        # Otherwise the site kinds do not pair up across the periodic
+        # boundary and the numeric Hamiltonian is not Hermitian
+        if not self.stencil_tiles():
+            raise ValueError(f"dy must be a multiple of 4 for a numeric "
+                             f"Hamiltonian, got {self.dy}")
+
+    def stencil_table(self) -> NeighborTable:
+        # Neighbor table of the four-site stencil written as Fortran
+        # expressions of the loop indices `ix` (row) and `iy` (first orbital of
+        # the stencil within the row). Only valid when the stencil tiles a
+        # row, see lattice_loops.
+        size = self.orbitals * self.dy
+        period = 4 * self.orbitals
+
+        source = np.arange(period)
+        site_kind = self.normalize_site(source) % 4
+        direction = np.array([Site.direction for Site in self.sites])
+
+        target = np.empty((period, 3), dtype=object)
+        for x0_coordinate, kind in zip(source, site_kind):
+            for bond, delta in enumerate(self.sites[kind].delta):
+                x = loop_index("ix", delta[0], self.dx)
+                shift = x0_coordinate + self.orbitals * delta[1]
+                if 0 <= shift < period:
+                    target[x0_coordinate,
+                           bond] = LoopIndex(f"{x}*{size} + iy", shift)
+                else:
+                    y = loop_index("iy", shift, size)
+                    target[x0_coordinate,
+                           bond] = LoopIndex(f"{x}*{size} + {y}")
+
+        return NeighborTable(source, target, direction[site_kind], site_kind,
+                             None)
+
+    def spinless_elements(self, table: NeighborTable) -> MatrixElements:
+        row = np.broadcast_to(table.source[:, np.newaxis] + 1,
+                              table.target.shape)
+        col = table.target + 1
+        result = np.full(table.target.shape, self.expressions.intern("t"))
+
+        return MatrixElements("tij1", table.source, table.direction, row, col,
+                              result, table.winding)
+
+    def rashba_elements(self, table: NeighborTable) -> MatrixElements:
+        spin = table.source % 2 == 0
+        rashba = np.array([[[self.expressions.intern(expression)
+                             for expression in Site.rashba(spin)]
+                            for spin in [False, True]]
+                           for Site in self.sites])
+
+        row = np.broadcast_to(table.source[:, np.newaxis] + 1,
+                              table.target.shape)
+        col = np.where(spin[:, np.newaxis], table.target + 2, table.target)
+        result = rashba[table.site_kind, spin.astype(int)]
+
+        return MatrixElements("tij2", table.source, table.direction, row, col,
+                              result, table.winding)
+
+    def external_mag_elements(self, table: NeighborTable) -> MatrixElements:
+        spin = table.source % 2 == 0
+        external_mag = np.array([[
+                self.expressions.intern(external_mag_mat(1, 1)),
+                self.expressions.intern(external_mag_mat(1, 0))
+        ], [
+                self.expressions.intern(external_mag_mat(0, 0)),
+                self.expressions.intern(external_mag_mat(0, 1))
+        ]])
+
+        row = np.repeat(table.source[:, np.newaxis] + 1, 2, axis=1)
+        col = np.stack([table.source + 1,
+                        np.where(spin, table.source + 2, table.source)],
+                       axis=-1)
+        result = external_mag[spin.astype(int)]
+
+        return MatrixElements("tij3", table.source, np.zeros_like(row), row,
+                              col, result, np.zeros(row.shape + (2, ),
+                                                    dtype=int))
+
+    def write_elements(self,
+                       elements: MatrixElements,
+                       writer: FortranWriter = None) -> None:
+        writer = self.writer if writer is None else writer
+        with self.profile.phase("formatting"):
+            writer.matrix_elements(elements.name,
+                                   elements.direction,
+                                   elements.row,
+                                   elements.col,
+                                   result=elements.result,
+                                   orbitals=elements.source + 1,
+                                   expressions=self.expressions)
+            self.profile.count(elements=elements.result.size)
+
+    def terms(self) -> list:
+        terms = [("Nearest neighbors interaction", self.spinless_elements)]
+        if self.rashba_soc:
+            terms.append(
+                    ("Rashba Spin Orbit Interaction", self.rashba_elements))
+        if self.external_mag:
+            terms.append(("Exchange Interaction", self.external_mag_elements))
+        return terms
 
     def normalize_site(self, coord: int) -> int:
-        return int(np.ceil(coord // self.orbitals))
+        return coord // self.orbitals
 
     def convert_to_orbital(self, sites: list) -> list:
         res = []
@@ -282,28 +442,438 @@ class Graphene:
                 res.append(self.orbitals * (site - 1) + 1 + orb)
         return res
 
+    def removed_mask(self, orbitals: list) -> np.array:
+        # Indexed by the 1-based orbital. The two extra entries absorb the
+        # indices just outside the lattice that the spin-flip terms produce
+        # when there is a single orbital per site.
+        size = self.dx * self.orbitals * self.dy
+        orbitals = np.asarray(orbitals, dtype=int)
+        if np.any((orbitals < 1) | (orbitals > size)):
+            raise ValueError(f"Removed sites must be between 1 and "
+                             f"{size // self.orbitals}")
+
+        mask = np.zeros(size + 2, dtype=bool)
+        mask[orbitals] = True
+        return mask
+
     def project_out_sites(self) -> None:
-        for site in self.sites_removed:
-            self.writer.comment(f"Orbital {site}")
-            self.writer.matrix_element("tij0", 0, site, site, result=1000000.0)
+        sites = np.flatnonzero(self.removed)
+        with self.profile.phase("formatting"):
+            self.writer.matrix_elements(
+                    "tij0",
+                    np.zeros_like(sites),
+                    sites,
+                    sites,
+                    result=np.full(
+                            sites.shape,
+                            self.expressions.intern(removed_site_penalty)),
+                    orbitals=sites,
+                    expressions=self.expressions)
+            self.profile.count(elements=sites.size)
+
+    def chunks(self) -> list:
+        step = max(1, chunk_orbitals // (self.orbitals * self.dy))
+        return [
+                range(start, min(start + step, self.dx))
+                for start in range(0, self.dx, step)
+        ]
+
+    def write_chunk(self, terms: list, rows: range, writers: list) -> list:
+        with self.profile.phase("neighbor table"):
+            table = self.neighbor_table(rows)
+        for (comment, elements_fn), writer in zip(terms, writers):
+            with self.profile.phase(comment):
+                self.write_elements(
+                        self.check_removed_elements(elements_fn(table)),
+                        writer)
+        return writers
+
+    def lattice(self, *terms, jobs: int = 1) -> None:
+        # Walk the lattice once, feeding every (comment, elements_fn) term
+        # from the same neighbor table. The first section goes straight to
+        # the writer and the others are spooled (FortranWriter uses temporary
+        # files) until the walk is over, so the output stays grouped by term.
+        # With several jobs the chunks of rows are formatted by a process
+        # pool and merged back in order, giving the same output.
+        writers = [self.writer] + [self.writer.spool() for _ in terms[1:]]
+        for (comment, _), writer in zip(terms, writers):
+            writer.comment(comment)
+
+        if jobs == 1:
+            for rows in self.chunks():
+                self.write_chunk(terms, rows, writers)
+        else:
+            names = [(comment, elements_fn.__name__)
+                     for comment, elements_fn in terms]
+            with ProcessPoolExecutor(
+                    jobs,
+                    initializer=init_lattice_worker,
+                    initargs=(self, names,
+                              isinstance(self.profile, Profile))) as pool:
+                pending = deque()
+                for rows in self.chunks():
+                    pending.append(
+                            pool.submit(lattice_worker, rows,
+                                        [writer.fragment()
+                                         for writer in writers]))
+                    if len(pending) > 2 * jobs:
+                        self.merge_fragments(writers, pending.popleft())
+                while pending:
+                    self.merge_fragments(writers, pending.popleft())
+
+        for writer in writers[1:]:
+            self.writer.merge(writer)
+
+    def merge_fragments(self, writers: list, future) -> None:
+        fragments, profile = future.result()
+        for writer, fragment in zip(writers, fragments):
+            writer.merge(fragment)
+        self.profile.merge(profile)
+
+    def __getstate__(self):
+        # Worker processes get the lattice without its (output) writer
+        state = self.__dict__.copy()
+        state['writer'] = None
+        state['tables'] = None
+        state['profile'] = NullProfile()
+        return state
+
+    def lattice_loops(self, *terms, jobs: int = 1) -> None:
+        # Compact form of lattice(): a DO loop nest per term over the
+        # repeated four-site stencil, followed by explicit zeros for the
+        # bonds of removed sites. The loop indices `ix` and `iy` have to be
+        # declared as integers by the including program. Lattices where the
+        # stencil does not tile a row are written explicitly, on `jobs`
+        # processes.
+        size = self.orbitals * self.dy
+        period = 4 * self.orbitals
+        if not self.stencil_tiles():
+            self.lattice(*terms, jobs=jobs)
+            return
+
+        stencil = self.stencil_table()
+        origin = f"ix*{size} + iy"
+        for comment, elements_fn in terms:
+            elements = elements_fn(stencil)
+            self.writer.comment(comment)
+            self.writer.append(f"do ix = 0, {self.dx - 1}")
+            self.writer.append(f"  do iy = 0, {size - 1}, {period}")
+            results = self.writer.format_results(elements.result,
+                                                 self.expressions)
+            for direction, row, col, result in zip(
+                    elements.direction.ravel().tolist(),
+                    elements.row.ravel().tolist(),
+                    elements.col.ravel().tolist(),
+                    results.ravel().tolist()):
+                if not isinstance(col, LoopIndex):
+                    col = LoopIndex(origin, col)
+                self.writer.append(f"    {elements.name}({direction}, "
+                                   f"{LoopIndex(origin, row)}, {col}) = "
+                                   f"{result}")
+            self.writer.append("  end do")
+            self.writer.append("end do")
             self.writer.newline()
 
-    def lattice(self, print_matrix_component_fn) -> None:
-        for di in range(self.dx):
-            for dj in range(self.orbitals * self.dy):
-                x0 = np.array([di, dj])
-                x0_coordinate = self.convert_coordinates(x0)
-                site_kind = self.normalize_site(x0_coordinate) % 4
-                self.writer.comment(f"Orbital {x0_coordinate + 1}")
-                if site_kind == 0:
-                    print_matrix_component_fn(x0, x0_coordinate, self.Site.A)
-                elif site_kind == 1:
-                    print_matrix_component_fn(x0, x0_coordinate, self.Site.B)
-                elif site_kind == 2:
-                    print_matrix_component_fn(x0, x0_coordinate, self.Site.C)
-                elif site_kind == 3:
-                    print_matrix_component_fn(x0, x0_coordinate, self.Site.D)
-                self.writer.newline()
+        if not self.removed.any():
+            return
+
+        self.writer.comment("Bonds of removed sites")
+        for rows in self.chunks():
+            table = self.neighbor_table(rows)
+            for _, elements_fn in terms:
+                elements = elements_fn(table)
+                removed = self.is_removed_elements(elements)
+                self.writer.matrix_elements(elements.name,
+                                            elements.direction[removed],
+                                            elements.row[removed],
+                                            elements.col[removed],
+                                            result=np.full(
+                                                    removed.sum(),
+                                                    self.expressions.intern(
+                                                            "0.0")),
+                                            expressions=self.expressions)
+
+    def numeric_elements(self,
+                         t: float,
+                         rsoc: float,
+                         j_ex: float,
+                         theta: float,
+                         phi: float,
+                         source: np.array = None,
+                         keep_zeros: bool = False) -> tuple:
+        # 0-based rows and columns, values and windings of every nonzero
+        # matrix element, removed site penalties included. `source` restricts
+        # them to the rows of the given 0-based orbitals.
+        if (self.rashba_soc or self.external_mag) and self.orbitals != 2:
+            raise ValueError("Rashba and exchange terms need orbitals=2")
+        self.check_tiling()
+
+        table = self.neighbor_table(source=source)
+        values_by_id = evaluate_elements(
+                self.expressions,
+                dict(t=t, rsoc=rsoc, j_ex=j_ex, theta=theta, phi=phi))
+        rows, cols, values, winding = [], [], [], []
+        for _, elements_fn in self.terms():
+            elements = self.check_removed_elements(elements_fn(table))
+            rows.append(elements.row.ravel())
+            cols.append(elements.col.ravel())
+            values.append(values_by_id[elements.result.ravel()])
+            winding.append(elements.winding.reshape(-1, 2))
+
+        removed = table.source[self.removed[table.source + 1]] + 1
+        rows.append(removed)
+        cols.append(removed)
+        values.append(np.full(removed.shape, removed_site_penalty))
+        winding.append(np.zeros((removed.size, 2), dtype=int))
+
+        values = np.concatenate(values)
+        nonzero = values != 0.0
+        if keep_zeros:
+            nonzero[:] = True
+        return (np.concatenate(rows)[nonzero] - 1,
+                np.concatenate(cols)[nonzero] - 1, values[nonzero],
+                np.concatenate(winding)[nonzero])
+
+    def hamiltonian(self,
+                    t: float = 1.0,
+                    rsoc: float = 0.0,
+                    j_ex: float = 0.0,
+                    theta: float = 0.0,
+                    phi: float = 0.0,
+                    format: str = 'csr',
+                    keep_zeros: bool = False) -> scipy.sparse.spmatrix:
+        # With `keep_zeros` every bond and every diagonal element has an
+        # entry, zero or not, which is the structure update_removed needs to
+        # write in place. The matrix is assembled by chunks of rows into
+        # arrays sized after the first one, so besides the matrix only the
+        # neighbor tables and triplets of one chunk are held at a time.
+        size = self.dx * self.orbitals * self.dy
+        chunks = self.chunks()
+        data = np.empty(0, dtype=complex)
+        indices = np.empty(0, dtype=np.int32)
+        indptr = np.empty(size + 1, dtype=np.int64)
+        start = 0
+        for rows in chunks:
+            source = np.arange(rows.start * self.orbitals * self.dy,
+                               rows.stop * self.orbitals * self.dy)
+            block = self.hamiltonian_block(source,
+                                           (t, rsoc, j_ex, theta, phi),
+                                           keep_zeros)
+            stop = start + block.nnz
+            if stop > data.size:
+                # Chunks hold alike rows, so this happens once in general
+                capacity = max(stop, block.nnz * len(chunks))
+                data = np.concatenate([data[:start],
+                                       np.empty(capacity - start,
+                                                dtype=complex)])
+                indices = np.concatenate(
+                        [indices[:start],
+                         np.empty(capacity - start, dtype=np.int32)])
+            data[start:stop] = block.data
+            indices[start:stop] = block.indices
+            indptr[source] = block.indptr[:-1] + start
+            start = stop
+        indptr[size] = start
+
+        if start > np.iinfo(np.int32).max:
+            indices = indices.astype(np.int64)
+        else:
+            indptr = indptr.astype(np.int32)
+        return scipy.sparse.csr_matrix(
+                (data[:start], indices[:start], indptr),
+                shape=(size, size)).asformat(format)
+
+    def hamiltonian_block(self, source: np.array, parameters: tuple,
+                          keep_zeros: bool) -> scipy.sparse.csr_matrix:
+        # Rows of the Hamiltonian for the consecutive 0-based orbitals
+        # `source`
+        rows, cols, values, _ = self.numeric_elements(*parameters,
+                                                      source=source,
+                                                      keep_zeros=keep_zeros)
+        if keep_zeros:
+            rows = np.concatenate([rows, source])
+            cols = np.concatenate([cols, source])
+            values = np.concatenate([values, np.zeros(source.size)])
+
+        size = self.dx * self.orbitals * self.dy
+        block = scipy.sparse.coo_matrix((values, (rows - source[0], cols)),
+                                        shape=(source.size, size),
+                                        dtype=complex)
+        block.sum_duplicates()
+        return block.tocsr()
+
+    def update_removed(self,
+                       matrix: scipy.sparse.spmatrix,
+                       remove: list = [],
+                       restore: list = [],
+                       t: float = 1.0,
+                       rsoc: float = 0.0,
+                       j_ex: float = 0.0,
+                       theta: float = 0.0,
+                       phi: float = 0.0) -> scipy.sparse.csr_matrix:
+        # Removes the sites `remove` and restores the sites `restore`, then
+        # patches `matrix`, the Hamiltonian of the lattice before the change,
+        # instead of regenerating it. Only the rows and columns of the
+        # affected orbitals are evaluated, at a cost proportional to the
+        # number of changed sites. A CSR matrix from
+        # hamiltonian(keep_zeros=True) is updated in place, its structure
+        # untouched. With any other matrix, entries missing from the
+        # structure, such as the penalty of a site removed for the first
+        # time, are inserted at the cost of a pass over the matrix, and scipy
+        # warns about it.
+        changed = self.convert_to_orbital(list(remove) + list(restore))
+        self.removed_mask(changed)
+        self.removed[self.convert_to_orbital(remove)] = True
+        self.removed[self.convert_to_orbital(restore)] = False
+
+        parameters = (t, rsoc, j_ex, theta, phi)
+        affected = np.unique(np.asarray(changed, dtype=int)) - 1
+        _, neighbors, _, _ = self.numeric_elements(*parameters,
+                                                   source=affected,
+                                                   keep_zeros=True)
+        rows, cols, values, _ = self.numeric_elements(
+                *parameters,
+                source=np.union1d(affected, neighbors),
+                keep_zeros=True)
+
+        # Every element of an entry touching the affected orbitals has its
+        # row among the affected orbitals or their neighbors
+        touched = np.isin(rows, affected) | np.isin(cols, affected)
+        size = self.dx * self.orbitals * self.dy
+        entries, inverse = np.unique(rows[touched] * size + cols[touched],
+                                     return_inverse=True)
+        summed = np.zeros(entries.size, dtype=complex)
+        np.add.at(summed, inverse, values[touched])
+
+        matrix = matrix.tocsr()
+        matrix[entries // size, entries % size] = summed
+        return matrix
+
+    def eigenpairs(self,
+                   count: int,
+                   target: float = 0.0,
+                   t: float = 1.0,
+                   rsoc: float = 0.0,
+                   j_ex: float = 0.0,
+                   theta: float = 0.0,
+                   phi: float = 0.0) -> tuple:
+        # The `count` eigenpairs closest to `target`, in increasing energy.
+        # Removed orbitals are dropped before diagonalizing, so the penalty
+        # neither shows up among the eigenvalues nor spoils the conditioning
+        # of the shift-invert factorization; their eigenvector components
+        # are zero. Eigenvectors are the columns of an array with one row
+        # per orbital. eigsh assumes a Hermitian matrix and quietly returns
+        # a wrong spectrum otherwise, hence the check up front.
+        self.check_tiling()
+        kept = self.kept_orbitals()
+        if not 0 < count <= kept.size:
+            raise ValueError(f"Number of eigenpairs must be between 1 and "
+                             f"{kept.size}")
+
+        matrix = self.hamiltonian(t, rsoc, j_ex, theta, phi)[kept][:, kept]
+        if matrix.imag.count_nonzero() == 0:
+            matrix = matrix.real
+        if count >= kept.size - 1:
+            # ARPACK needs count < n - 1, fall back to a dense solver
+            values, vectors = np.linalg.eigh(matrix.toarray())
+            closest = np.sort(np.argsort(np.abs(values - target))[:count])
+            values, vectors = values[closest], vectors[:, closest]
+        else:
+            matrix = matrix.tocsc()
+            try:
+                values, vectors = scipy.sparse.linalg.eigsh(matrix,
+                                                            k=count,
+                                                            sigma=target)
+            except RuntimeError:
+                # `target` is an exact eigenvalue (isolated orbitals, zero
+                # modes) and the factorization is singular, so shift it
+                # slightly
+                shift = 1e-9 * max(abs(matrix).sum(axis=0).max(), 1.0)
+                values, vectors = scipy.sparse.linalg.eigsh(
+                        matrix, k=count, sigma=target + shift)
+            order = np.argsort(values)
+            values, vectors = values[order], vectors[:, order]
+
+        size = self.dx * self.orbitals * self.dy
+        full = np.zeros((size, count), dtype=vectors.dtype)
+        full[kept] = vectors
+        return values, full
+
+    def bloch_hamiltonian(self,
+                          k: np.array,
+                          t: float = 1.0,
+                          rsoc: float = 0.0,
+                          j_ex: float = 0.0,
+                          theta: float = 0.0,
+                          phi: float = 0.0) -> np.array:
+        # Hamiltonian with twisted boundary conditions: an element wrapping
+        # around the lattice picks up the phase exp(i k . winding). For the
+        # four-site cell Graphene(1, 4) this is the Bloch Hamiltonian H(k),
+        # with k the phase per cell along the rows and along the columns.
+        # `k` has shape (..., 2) and the result (..., n, n), n the number of
+        # orbitals, every k-point being evaluated at once.
+        k = np.asarray(k, dtype=float)
+        rows, cols, values, winding = self.numeric_elements(
+                t, rsoc, j_ex, theta, phi)
+
+        size = self.dx * self.orbitals * self.dy
+        scatter = scipy.sparse.csr_matrix(
+                (np.ones(values.size),
+                 (rows * size + cols, np.arange(values.size))),
+                shape=(size * size, values.size))
+
+        phases = np.exp(1j * k.reshape(-1, 2) @ winding.T) * values
+        matrices = (scatter @ phases.T).T
+        return matrices.reshape(k.shape[:-1] + (size, size))
+
+
+lattice_worker_state = {}
+
+
+def init_lattice_worker(lattice: Graphene, names: list,
+                        profiled: bool) -> None:
+    lattice_worker_state['lattice'] = lattice
+    lattice_worker_state['terms'] = [(comment, getattr(lattice, name))
+                                     for comment, name in names]
+    lattice_worker_state['profiled'] = profiled
+
+
+def lattice_worker(rows: range, fragments: list) -> tuple:
+    # The fragments of a chunk, and its profile to be merged into the one of
+    # the parent
+    lattice = lattice_worker_state['lattice']
+    lattice.profile = (Profile()
+                       if lattice_worker_state['profiled'] else NullProfile())
+    fragments = lattice.write_chunk(lattice_worker_state['terms'], rows,
+                                    fragments)
+    return fragments, lattice.profile
+
+
+class LoopIndex:
+    # Orbital index inside the loops written by Graphene.lattice_loops: a
+    # Fortran expression plus a constant offset. Adding an integer shifts the
+    # offset, so the element builders work on it as on a plain index.
+    def __init__(self, expression: str, offset: int = 0):
+        self.expression = expression
+        self.offset = offset
+
+    def __add__(self, offset: int):
+        return LoopIndex(self.expression, self.offset + offset)
+
+    def __str__(self):
+        return loop_index(self.expression, self.offset)
+
+
+def loop_index(variable: str, shift: int, period: int = None) -> str:
+    expression = variable
+    if shift > 0:
+        expression = f"{variable} + {shift}"
+    elif shift < 0:
+        expression = f"{variable} - {-shift}"
+
+    if period is None or shift == 0:
+        return expression
+    return f"modulo({expression}, {period})"
 
 
 def external_mag_mat(i, j) -> str:
@@ -312,9 +882,138 @@ def external_mag_mat(i, j) -> str:
     return mat[i][j]
 
 
-def argument_scaffolding(args) -> None:
-
-    writer = FortranWriter()
+def evaluate_expression(expression: str, **parameters) -> complex:
+    namespace = dict(comp=1j,
+                     sqrt=np.sqrt,
+                     exp=np.exp,
+                     cos=np.cos,
+                     sin=np.sin,
+                     **parameters)
+    return complex(eval(expression, {"__builtins__": {}}, namespace))
+
+
+def evaluate_elements(expressions: ExpressionTable,
+                      parameters: dict) -> np.array:
+    return np.array([
+            evaluate_expression(expression, **parameters)
+            for expression in expressions
+    ])
+
+
+def batch_argument_scaffolding(configurations: list,
+                               geometry_tables: dict = None) -> None:
+    # Configurations with the same geometry are generated one after the
+    # other, sharing their neighbor tables. `geometry_tables` keeps the
+    # tables by geometry across calls.
+    geometries = {}
+    for args in configurations:
+        geometries.setdefault((args.dx, args.dy, args.orbitals),
+                              []).append(args)
+
+    for geometry, group in geometries.items():
+        if geometry_tables is None:
+            tables = {}
+        else:
+            tables = geometry_tables.setdefault(geometry, {})
+        for args in group:
+            argument_scaffolding(args, tables)
+
+
+def argument_scaffolding(args, tables: dict = None) -> None:
+
+    profile = Profile() if args.profile else NullProfile()
+    if args.cache:
+        cached_output(args, tables, profile)
+    else:
+        write_output(args, args.output, tables, profile)
+
+    if args.profile:
+        profile.write(args.profile)
+
+
+def cached_output(args, tables: dict, profile: Profile) -> None:
+
+    lattice = Graphene(dx=args.dx,
+                       dy=args.dy,
+                       orbitals=args.orbitals,
+                       rashba_soc=args.rashba_soc,
+                       external_mag=args.external_mag,
+                       sites_removed=args.remove_sites)
+    cache = Cache(args.cache,
+                  None if args.cache_size is None else
+                  int(args.cache_size * (1 << 20)))
+
+    # NumpyWriter packs an .npz archive or fills a directory depending on
+    # the name it is given
+    name = 'output.npz' if (args.output or '').endswith('.npz') else 'output'
+    key = cache.key(kind='output',
+                    **lattice.configuration(),
+                    format=args.format,
+                    loops=args.loops,
+                    intern=args.intern,
+                    name=name)
+    path = cache.get(key, name)
+    if path is None:
+        path = cache.put(
+                key, name,
+                lambda path: write_output(args, path, tables, profile))
+
+    try:
+        if path is None:
+            raise FileNotFoundError(key)
+        with profile.phase("copy from cache"):
+            copy_output(path, args.output)
+    except FileNotFoundError:
+        # Evicted by another job in the meantime, possibly right after
+        # being stored
+        write_output(args, args.output, tables, profile)
+
+
+def write_output(args,
+                 output: str,
+                 tables: dict = None,
+                 profile: Profile = NullProfile()) -> None:
+
+    if args.format == 'numpy':
+        writer = NumpyWriter(output)
+        generate(args, writer, tables, profile)
+        with profile.phase("output"):
+            writer.close()
+            profile.count(bytes=disk_usage(output))
+    elif output:
+        with open(output, 'w') as stream:
+            generate(args,
+                     FortranWriter(profile.stream(stream),
+                                   intern=args.intern), tables, profile)
+    else:
+        generate(args,
+                 FortranWriter(profile.stream(sys.stdout),
+                               intern=args.intern), tables, profile)
+
+
+def disk_usage(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(path) for name in names)
+
+
+def copy_output(path: str, output: str) -> None:
+
+    if output is None:
+        with open(path) as stream:
+            shutil.copyfileobj(stream, sys.stdout)
+    elif os.path.isdir(path):
+        shutil.copytree(path, output, dirs_exist_ok=True)
+    else:
+        shutil.copyfile(path, output)
+
+
+def generate(args,
+             writer: FortranWriter,
+             tables: dict = None,
+             profile: Profile = NullProfile()) -> None:
 
     if (args.lattice == 'graphene'):
 
@@ -324,21 +1023,23 @@ def argument_scaffolding(args) -> None:
                            rashba_soc=args.rashba_soc,
                            external_mag=args.external_mag,
                            sites_removed=args.remove_sites,
-                           writer=writer)
+                           writer=writer,
+                           tables=tables,
+                           profile=profile)
+
+        writer.expression_table(lattice.expressions)
 
         if args.remove_sites:
             writer.comment("Sites projected out")
-            lattice.project_out_sites()
+            with profile.phase("project_out_sites"):
+                lattice.project_out_sites()
 
-        writer.comment("Nearest neighbors interaction")
-        lattice.lattice(lattice.print_matrix_component_spinless)
-
-        if args.rashba_soc:
-            writer.comment("Rashba Spin Orbit Interaction")
-            lattice.lattice(lattice.print_matrix_component_rashba)
-
-        if args.external_mag:
-            writer.comment("Exchange Interaction")
-            lattice.lattice(lattice.print_matrix_component_external_mag)
+        if args.loops:
+            with profile.phase("lattice_loops"):
+                lattice.lattice_loops(*lattice.terms(), jobs=args.jobs)
+        else:
+            with profile.phase("lattice"):
+                lattice.lattice(*lattice.terms(), jobs=args.jobs)
 
-    print(writer, end='')
+    with profile.phase("flush"):
+        writer.flush()
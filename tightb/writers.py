@@ -16,13 +16,59 @@
 # You should have received a copy of the GNU General Public License
 # along with tightb.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
 from io import StringIO
 
 
+class ExpressionTable:
+    # Numbered table of the distinct expressions of the matrix elements, so
+    # that an element refers to its expression by id.
+    def __init__(self, expressions: list = ()):
+        self._expressions = []
+        self._ids = {}
+        self._lookup = None
+        for expression in expressions:
+            self.intern(expression)
+
+    def __len__(self):
+        return len(self._expressions)
+
+    def __iter__(self):
+        return iter(self._expressions)
+
+    def intern(self, expression) -> int:
+        expression = str(expression)
+        if expression not in self._ids:
+            self._ids[expression] = len(self._expressions)
+            self._expressions.append(expression)
+            self._lookup = None
+        return self._ids[expression]
+
+    def lookup(self, ids: np.array) -> np.array:
+        if self._lookup is None:
+            self._lookup = np.array(self._expressions, dtype=object)
+        return self._lookup[ids]
+
+
 class FortranWriter:
-    def __init__(self):
+    # Without a stream the whole output is kept in memory. With a stream
+    # (any file-like object) the output is written through once the buffer
+    # holds `buffer_size` characters, so memory use does not grow with the
+    # size of the output. With `intern` the expressions are written once, as
+    # assignments to the array `expr` declared by the including program, and
+    # the matrix elements refer to them by id.
+    def __init__(self,
+                 stream=None,
+                 buffer_size: int = 1 << 16,
+                 intern: bool = False):
         self._buffer = StringIO()
-        pass
+        self._stream = stream
+        self._buffer_size = buffer_size
+        self._intern = intern
 
     def __str__(self):
         return self._buffer.getvalue()
@@ -30,11 +76,48 @@ class FortranWriter:
     def toString(self):
         return self._buffer.getvalue()
 
+    def spool(self):
+        return FortranWriter(tempfile.TemporaryFile('w+'),
+                             intern=self._intern)
+
+    def fragment(self):
+        return FortranWriter(intern=self._intern)
+
+    def merge(self, spooled, size: int = 1 << 16):
+        if spooled._stream is None:
+            self._write(spooled.toString())
+            return
+
+        spooled.flush()
+        spooled._stream.seek(0)
+        for text in iter(lambda: spooled._stream.read(size), ''):
+            self._write(text)
+        spooled._stream.close()
+
+    def close(self):
+        self.flush()
+
+    def flush(self):
+        if self._stream is None:
+            return
+        self._stream.write(self._buffer.getvalue())
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._stream.flush()
+
+    def _write(self, text: str):
+        self._buffer.write(text)
+        if self._stream is not None and \
+                self._buffer.tell() >= self._buffer_size:
+            self._stream.write(self._buffer.getvalue())
+            self._buffer.seek(0)
+            self._buffer.truncate()
+
     def newline(self):
-        print(end='\n', file=self._buffer)
+        self._write('\n')
 
     def append(self, *objects):
-        print(*objects, sep=' ', end='\n', file=self._buffer)
+        self._write(' '.join(map(str, objects)) + '\n')
 
     def comment(self, *msg: str) -> None:
         self.append("!", *msg)
@@ -42,3 +125,202 @@ class FortranWriter:
     def matrix_element(self, matrix_name: str, *indices: int,
                        result: str) -> None:
         self.append(f"{matrix_name}{indices} = {result}")
+
+    def expression_table(self, expressions: ExpressionTable) -> None:
+        if not self._intern:
+            return
+        self.comment(f"Expressions, expr(0:{len(expressions) - 1})")
+        for id, expression in enumerate(expressions):
+            self.append(f"expr({id}) = {expression}")
+        self.newline()
+
+    def format_results(self, ids: np.array,
+                       expressions: ExpressionTable) -> np.array:
+        if self._intern:
+            return np.char.mod("expr(%d)", ids).astype(object)
+        return expressions.lookup(ids)
+
+    def matrix_elements(self,
+                        matrix_name: str,
+                        *indices: np.array,
+                        result: np.array,
+                        orbitals: np.array = None,
+                        expressions: ExpressionTable = None) -> None:
+        # Bulk version of matrix_element: every argument holds one row per
+        # block and one column per element, and the whole block is formatted
+        # by a single string interpolation. When `orbitals` is given each row
+        # is written as "! Orbital n", its elements and a blank line. With
+        # `expressions` the results are ids into that table.
+        if expressions is not None:
+            result = self.format_results(result, expressions)
+
+        def as_block(values, dtype=None):
+            values = np.asarray(values, dtype=dtype)
+            return values[:, np.newaxis] if values.ndim == 1 else values
+
+        result = as_block(result, dtype=object)
+        indices = [as_block(index) for index in indices]
+        rows, columns = result.shape
+
+        index_format = ", ".join(["%d"] * len(indices))
+        if len(indices) == 1:
+            index_format += ","
+        line = f"{matrix_name}({index_format}) = %s\n"
+        template = line * columns
+
+        values = [np.broadcast_to(index, result.shape) for index in indices]
+        values = np.stack(values + [result], axis=-1).reshape(rows, -1)
+        if orbitals is not None:
+            template = "! Orbital %d\n" + template + "\n"
+            values = np.concatenate(
+                    [as_block(orbitals, dtype=object), values], axis=1)
+
+        self._write((template * rows) % tuple(values.ravel().tolist()))
+
+
+class NumpyWriter:
+    # Matrix elements as flat arrays, one entry per element, written as raw
+    # .npy files in the directory `path` that can be opened with
+    # np.load(mmap_mode='r'). `matrix` and `term_id` index the `matrices`
+    # and `expressions` string tables. The arrays grow on disk as elements
+    # arrive; flush() brings the headers up to date. A path ending in .npz
+    # is packed into a single archive when the writer is closed.
+    arrays = {
+            'matrix': np.dtype('<i1'),
+            'direction': np.dtype('<i1'),
+            'row': np.dtype('<i8'),
+            'col': np.dtype('<i8'),
+            'term_id': np.dtype('<i4'),
+    }
+
+    header_size = 128
+
+    def __init__(self, path: str):
+        self.path = path
+        self.matrices = ExpressionTable()
+        self.expressions = ExpressionTable()
+        self._length = 0
+
+        if path.endswith('.npz'):
+            self._directory = tempfile.mkdtemp()
+        else:
+            self._directory = path
+            os.makedirs(path, exist_ok=True)
+
+        self._files = {}
+        for name, dtype in self.arrays.items():
+            self._files[name] = open(
+                    os.path.join(self._directory, f"{name}.npy"), 'wb')
+            self._files[name].write(self._header(dtype, 0))
+
+    def _header(self, dtype: np.dtype, length: int) -> bytes:
+        header = repr({
+                'descr': np.lib.format.dtype_to_descr(dtype),
+                'fortran_order': False,
+                'shape': (length, ),
+        })
+        header = header.ljust(self.header_size - 11) + '\n'
+        return b'\x93NUMPY\x01\x00' + struct.pack(
+                '<H', len(header)) + header.encode('latin1')
+
+    def _intern(self, values: np.array) -> np.array:
+        ids = np.empty(values.shape, dtype=np.int32)
+        for value in set(values.ravel().tolist()):
+            ids[values == value] = self.expressions.intern(value)
+        return ids
+
+    def expression_table(self, expressions: ExpressionTable) -> None:
+        pass
+
+    def format_results(self, ids: np.array,
+                       expressions: ExpressionTable) -> np.array:
+        return expressions.lookup(ids)
+
+    def newline(self):
+        pass
+
+    def append(self, *objects):
+        pass
+
+    def comment(self, *msg: str) -> None:
+        pass
+
+    def matrix_element(self, matrix_name: str, *indices: int,
+                       result: str) -> None:
+        self.matrix_elements(matrix_name,
+                             *[[index] for index in indices],
+                             result=[result])
+
+    def matrix_elements(self,
+                        matrix_name: str,
+                        direction: np.array,
+                        row: np.array,
+                        col: np.array,
+                        result: np.array,
+                        orbitals: np.array = None,
+                        expressions: ExpressionTable = None) -> None:
+        if expressions is None:
+            result = np.asarray(result, dtype=object)
+            term_id = self._intern(result)
+        else:
+            result = np.asarray(result)
+            term_id = np.array(
+                    [self.expressions.intern(expression)
+                     for expression in expressions],
+                    dtype=np.int32)[result]
+
+        columns = {
+                'matrix': np.full(result.shape,
+                                  self.matrices.intern(matrix_name)),
+                'direction': direction,
+                'row': row,
+                'col': col,
+                'term_id': term_id,
+        }
+        for name, dtype in self.arrays.items():
+            values = np.broadcast_to(columns[name], result.shape)
+            values.astype(dtype).tofile(self._files[name])
+        self._length += result.size
+
+    def spool(self):
+        return self
+
+    def merge(self, spooled):
+        pass
+
+    def flush(self):
+        for name, dtype in self.arrays.items():
+            stream = self._files[name]
+            stream.seek(0)
+            stream.write(self._header(dtype, self._length))
+            stream.seek(0, os.SEEK_END)
+            stream.flush()
+
+        for name, table in [('matrices', self.matrices),
+                            ('expressions', self.expressions)]:
+            np.save(os.path.join(self._directory, f"{name}.npy"),
+                    np.array(list(table), dtype=str))
+
+    def close(self):
+        self.flush()
+        for stream in self._files.values():
+            stream.close()
+
+        if self._directory != self.path:
+            np.savez(self.path, **read_numpy(self._directory))
+            shutil.rmtree(self._directory)
+
+
+def read_numpy(path: str, mmap_mode: str = 'r') -> dict:
+    # Arrays written by NumpyWriter. Arrays in a directory are memory mapped,
+    # an .npz archive is read into memory.
+    if path.endswith('.npz'):
+        with np.load(path) as archive:
+            return dict(archive)
+
+    names = list(NumpyWriter.arrays) + ['matrices', 'expressions']
+    return {
+            name: np.load(os.path.join(path, f"{name}.npy"),
+                          mmap_mode=mmap_mode)
+            for name in names
+    }